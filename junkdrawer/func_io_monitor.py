@@ -8,7 +8,9 @@ Use Cases:
 
 Usage:
 
->>from func_io_monitor import func_io_monitor, class_io_monitor, RECORD_TYPES
+>>from func_io_monitor import func_io_monitor, class_io_monitor, get_recorder, load_recording, RECORD_TYPES
+>>from func_io_monitor import LatencyHistograms, EveryNSampler, ProbabilitySampler, TokenBucketSampler, CallCache
+>>from func_io_monitor import merge_shards, BinaryRecordReader
 >>
 >># EXAMPLE: Single Function
 >># For this example we want to monitor a single function called 'add'
@@ -54,26 +56,239 @@ Usage:
 >>#
 >>#2020-08-10 12:05:26 INFO     __main__.arith.del_ - IN: {'args': (0, -2), 'kwargs': {}} - OUT: 2
 >>
+>>
+>># EXAMPLE: Coroutines and generators
+>>
+>># Coroutine methods (and functions) are awaited, and timed over the whole await. Generator and
+>># async generator methods yield their items through, and record the first item_cap items (formatted
+>># as they are yielded) and the number of items when the stream is exhausted or closed. Static and
+>># class methods are monitored too.
+>>class service():
+>>    async def fetch(self, x):
+>>        await asyncio.sleep(0.1)
+>>        return x
+>>    async def stream(self, n):
+>>        for i in range(n):
+>>            yield i
+>>
+>>service_monitor = class_io_monitor(service(), record_type=RECORD_TYPES.jsonl, record_fp="service.jsonl",
+>>                                   timing=True, item_cap=2)
+>>await service_monitor.fetch(1)
+>>1
+>>[i async for i in service_monitor.stream(3)]
+>>[0, 1, 2]
+>>
+>># In 'service.jsonl', you will see:
+>># {"key": "__main__.service.fetch", ..., "in": {"args": [1], "kwargs": {}}, "out": "1", "wall_ns": 100312905, "cpu_ns": 41342}
+>># {"key": "__main__.service.stream", ..., "in": {"args": [3], "kwargs": {}}, "out": {"items": ["0", "1"], "count": 3}, ...}
+>>
+>>
+>># EXAMPLE: JSON lines
+>>
+>># For long running or frequently called functions, record in JSON lines format: one line is
+>># appended per call (buffered, see JSONL_FLUSH_SIZE and JSONL_FLUSH_INTERVAL), instead of
+>># rewriting the whole JSON file on every call. Buffered records are written on exit, or when
+>># the recorder is closed.
+>>add_monitor = func_io_monitor(add, record_type=RECORD_TYPES.jsonl, record_fp="add_monitor.jsonl",
+>>                              flush_size=1000)
+>>add_monitor(1,2)
+>>3
+>>
+>># In 'add_monitor.jsonl', you will see:
+>># {"key": "__main__.<none>.add", "time": 1597074458.0931141, "in": {"args": [1, 2], "kwargs": {}}, "out": "3"}
+>>
+>># Load a recording, grouped by function key as in the JSON format
+>>load_recording("add_monitor.jsonl")
+>>{'__main__.<none>.add': [{'time': 1597074458.0931141, 'in': {'args': [1, 2], 'kwargs': {}}, 'out': '3'}]}
+>>
+>># To share a recorder between monitors, or close it before exit, create it with get_recorder()
+>>recorder = get_recorder(RECORD_TYPES.jsonl, "arith.jsonl")
+>>arith_monitor = class_io_monitor(a, recorder=recorder)
+>>recorder.close()
+>>
+>>
+>># EXAMPLE: Background recording
+>>
+>># Record in a writer thread, so monitored calls only queue their (unformatted) input and output.
+>># If the queue is full, calls block until there is room (overflow="block"), or the newest or
+>># oldest queued call is dropped ("drop-newest", "drop-oldest") and counted in recorder.dropped.
+>># Note that input and output are formatted in the writer thread, so objects that are modified
+>># after the call returns are recorded as modified.
+>>recorder = get_recorder(RECORD_TYPES.jsonl, "add_monitor.jsonl", background=True,
+>>                        queue_size=10000, overflow="drop-oldest")
+>>add_monitor = func_io_monitor(add, recorder=recorder)
+>>
+>>
+>># EXAMPLE: Timing
+>>
+>># With timing=True, each record also has the wall and CPU (of the calling thread) duration of
+>># the call in nanoseconds. A LatencyHistograms collects the wall durations of calls per function
+>># key, and can be used without recording any input or output (record_type=None).
+>>latency = LatencyHistograms()
+>>arith_monitor = class_io_monitor(a, record_type=None, latency=latency)
+>>arith_monitor.add(1,2)
+>>3
+>>latency.snapshot()
+>>{'__main__.arith.add': {'count': 1, 'p50': 1966, 'p90': 1966, 'p99': 1966, 'max': 1966}}
+>>
+>># Append a snapshot to a JSON lines file on demand, or every 60 seconds in a background thread
+>>latency.dump("latency.jsonl")
+>>latency.start_periodic_dump(60, "latency.jsonl")
+>>
+>>
+>># EXAMPLE: Sampling
+>>
+>># Record only some calls. Skipped calls are not formatted. Samplers count per function key:
+>>#   EveryNSampler(100) - every 100th call
+>>#   ProbabilitySampler(0.01) - each call with probability 0.01
+>>#   TokenBucketSampler(10, burst=20) - at most 10 calls per second (after a burst of 20)
+>>add_monitor = func_io_monitor(add, record_type=RECORD_TYPES.jsonl, record_fp="add_monitor.jsonl",
+>>                              sampler=TokenBucketSampler(10, burst=20))
+>>
+>># Or keep a uniform random sample of at most 100 calls per function key in memory, which is
+>># recorded (and replaced by a new sample) when the recorder is flushed or closed
+>>recorder = get_recorder(RECORD_TYPES.jsonl, "arith.jsonl", reservoir_size=100)
+>>arith_monitor = class_io_monitor(a, recorder=recorder)
+>>recorder.close()
+>>
+>>
+>># EXAMPLE: Caching
+>>
+>># Return the cached output of calls with the same input (hashable, or else serializable to JSON),
+>># instead of calling the function. The cache keeps the most recently used outputs of at most
+>># maxsize calls, for at most ttl seconds. Cached calls are not recorded.
+>>cache = CallCache(maxsize=1024, ttl=60)
+>>add_monitor = func_io_monitor(add, record_type=None, cache=cache)
+>>add_monitor(1,2)
+>>3
+>>add_monitor(1,2)
+>>3
+>>cache.stats()
+>>{'__main__.<none>.add': {'hits': 1, 'misses': 1, 'evictions': 0, 'expirations': 0}}
+>>
+>># Warm the cache from a recording. Recorded outputs are cached as they were recorded, so record
+>># with an output formatter that keeps the output (e.g. lambda output: output), or supply an
+>># output_loader to convert them.
+>>cache.warm("add_monitor.jsonl", output_loader=int)
+>>
+>>
+>># EXAMPLE: Multiple processes
+>>
+>># When monitored code runs in many processes (e.g. forked web server workers), record each
+>># process to its own shard file, "<name>.<pid><ext>" (a process forked after the recorder is
+>># created switches to its own shard)
+>>recorder = get_recorder(RECORD_TYPES.jsonl, "add_monitor.jsonl", shard=True)
+>>
+>># Merge the shards into one recording, in time order
+>>merge_shards("add_monitor.jsonl", "add_monitor.merged.jsonl")
+>>
+>># or from the command line
+>>#   python func_io_monitor.py add_monitor.jsonl -o add_monitor.merged.jsonl
+>>
+>>
+>># EXAMPLE: Binary
+>>
+>># Record in a compact binary format, to segment files "<record_fp>.<number>" of about
+>># segment_size bytes (before compression), optionally compressed with "zlib" or "lzma"
+>>recorder = get_recorder(RECORD_TYPES.binary, "add_monitor.bin", segment_size=2 ** 26, compression="zlib")
+>>
+>># Read the records of a function key in a time range, skipping the segments and records (which are
+>># only decoded if they match) of other function keys and times
+>>reader = BinaryRecordReader("add_monitor.bin")
+>>for record in reader.iter_records("__main__.<none>.add", start=1597074458.0, end=1597074459.0):
+>>    print(record)
+>>{'key': '__main__.<none>.add', 'time': 1597074458.093114, 'in': {'args': [1, 2], 'kwargs': {}}, 'out': '3'}
+>>
+>># Shards ("add_monitor.<pid>.bin.<number>", with shard=True) are read with the recording, in time
+>># order, and can be merged into one recording
+>>merge_shards("add_monitor.bin", "add_monitor.merged.bin", record_type=RECORD_TYPES.binary)
 """
 
 
+import argparse
+import atexit
+from collections import Counter, OrderedDict, defaultdict
 from enum import Enum
+import functools
+import glob
+import heapq
 import inspect
+import itertools
 import json
 import logging
+import lzma
+import mmap
 import os
+import queue
+import random
+import struct
+import sys
+import threading
 import time
+from time import perf_counter_ns, thread_time_ns
+import types
+import weakref
+import zlib
 
 
 class RecordTypes(Enum):
     log = 0
     json = 1
+    jsonl = 2
+    binary = 3
 
     
 RECORD_TYPES = RecordTypes
 
+# buffered records of the jsonl record type are written when there are this many,
+# or when a record is added this many seconds after the last write
+JSONL_FLUSH_SIZE = 100
+JSONL_FLUSH_INTERVAL = 1.0
+
+# binary recordings are rotated to a new segment file after this many bytes of records
+# (before compression), and buffered records of uncompressed segments are written when
+# there are BINARY_FLUSH_SIZE bytes of them (or as for JSONL_FLUSH_INTERVAL)
+BINARY_SEGMENT_SIZE = 64 * 2 ** 20
+BINARY_FLUSH_SIZE = 64 * 2 ** 10
+BINARY_COMPRESSIONS = {None: 0, "zlib": 1, "lzma": 2}
+
+# what a background recorder does when its queue is full (see `get_recorder()`)
+OVERFLOW_POLICIES = ("block", "drop-newest", "drop-oldest")
+BACKGROUND_QUEUE_SIZE = 10000
+
+# latency histogram buckets split each power of 2 into 2 ** HISTOGRAM_SUB_BUCKET_BITS
+# buckets, so reported percentiles are at most 1 / 2 ** HISTOGRAM_SUB_BUCKET_BITS too high
+HISTOGRAM_SUB_BUCKET_BITS = 3
+HISTOGRAM_PERCENTILES = (50, 90, 99)
+
+# default maximum number of cached outputs of a CallCache
+CACHE_SIZE = 1024
+
+# default maximum number of recorded items of each stream of a monitored generator
+GENERATOR_ITEM_CAP = 100
+
+_LOGGER = logging.getLogger(__name__)
+_MISSING = object()
+# recorders with state to reset in a forked child process (see `_after_fork()`)
+_FORK_AWARE = weakref.WeakSet()
+# recorders to close at exit (see `_close_recorders()`), by creation order
+_CLOSE_AT_EXIT = weakref.WeakValueDictionary()
+_CLOSE_ORDER = itertools.count()
+
+# binary segment layout: header, records (compressed as one block if the segment is
+# compressed) and, once the segment is complete, a footer (JSON index of the function
+# keys in the segment, its length and FOOTER_MAGIC)
+_SEGMENT_HEADER = struct.Struct("<4sBBq")
+_SEGMENT_MAGIC = b"FIOM"
+_SEGMENT_VERSION = 1
+_FOOTER_LENGTH = struct.Struct("<I")
+_FOOTER_MAGIC = b"FIOE"
+# binary record kinds
+_KEY_RECORD = 0
+_CALL_RECORD = 1
+
 
-def func_io_monitor(func, record_type=RECORD_TYPES.log, record_fp=None, recorder=None, input_log_formatter=None, output_log_formatter=None):
+def func_io_monitor(func, record_type=RECORD_TYPES.log, record_fp=None, recorder=None, input_log_formatter=None, output_log_formatter=None, timing=False, latency=None, sampler=None, cache=None, item_cap=GENERATOR_ITEM_CAP, **recorder_options):
     """Creates a monitored I/O version of the function.
     
     Supplied function is not altered.
@@ -82,109 +297,1432 @@ def func_io_monitor(func, record_type=RECORD_TYPES.log, record_fp=None, recorder
         func(func): function or method to wrap
         logger (logger): python logging instance
         record_fp ():
-        record_type ():
+        record_type (): record format, or None to not record input and output
         input_log_formatter (func): a callable to use to format function input for logging.
         output_log_formatter (func): a callable to use to format function output for logging.
+        timing (bool): add the wall and CPU (of the calling thread) duration of each call to
+          its record, as "wall_ns" and "cpu_ns"
+        latency (LatencyHistograms): collect the wall duration of each call
+        sampler: only record the calls it samples (e.g. `EveryNSampler`), all calls are timed
+        cache (CallCache): return cached outputs of calls with the same input, instead of
+          calling the function (True for a CallCache with default arguments)
+        item_cap (int): maximum number of recorded items of a generator (see below)
+        recorder_options: options of the recorder (see `get_recorder()`)
 
-    Returns: (func) monitored function
+    Calls are recorded by function key, "<module>.<class>.<name>" ("<none>" for the class of
+    functions), which is resolved when the monitor is created.
+
+    Coroutine functions get a coroutine monitor, which records the awaited output and times
+    the whole await (CPU time only while the coroutine runs, not while it is suspended).
+
+    Generator and async generator functions get a generator monitor, which yields the items
+    of the stream as they are produced and records, when the stream is exhausted or closed,
+    {"items": [...], "count": <number of items>} with the first item_cap items (formatted
+    with output_log_formatter as they are yielded). Durations are the time spent producing
+    items, and streams are not cached.
+
+    Returns: (func) monitored function, with the name and docstring of func
     """
-    if not recorder:
-        recorder = _get_recorder(record_type, record_fp)
-    
-    def io_monitor(*args, **kwargs):
-        if "__self__" in dir(func):
-            func_class = str(func.__self__).split(" ")[0].strip("<")
-            func_key = ".".join([func_class, func.__name__])
-        else:
-            func_class = "<none>"
-            func_key = ".".join([func.__module__,func_class, func.__name__])
+    if not recorder and record_type is not None:
+        recorder = get_recorder(record_type, record_fp, **recorder_options)
+    if recorder is not None and not getattr(recorder, "enabled", True):
+        # e.g. a log recorder without a file, calls are not formatted for it
+        recorder = None
+    # resolved once, not per call
+    func_key = _function_key(func)
+    # recorders that format calls themselves (e.g. in a writer thread) take them unformatted
+    record_call = getattr(recorder, "record_call", None)
+    # custom recorders may not take durations
+    record_durations = timing and _accepts_keyword(recorder, "durations")
+    if cache is True:
+        cache = CallCache()
+
+    def sample():
+        """Whether to record a call"""
+        return recorder is not None and (sampler is None or sampler.sample(func_key))
+
+    def emit(args, kwargs, output, durations, output_formatter=output_log_formatter):
+        """Record a call, input and output are only formatted for calls that are recorded"""
+        if record_call is not None:
+            record_call(_Call(func_key, time.time(), args, kwargs, output, input_log_formatter, output_formatter,
+                              durations))
+            return
         if input_log_formatter:
             input_ = input_log_formatter(*args, **kwargs)
         else:
             # default - json structured str
             input_ = {"args": args, "kwargs": kwargs}
-        output = func(*args, **kwargs)
-        if output_log_formatter:
-            r_output = output_log_formatter(output)
+        if output_formatter:
+            r_output = output_formatter(output)
         else:
             # default - convert to str
             r_output = str(output)
-        recorder.record(func_key, input_, r_output)
+        if record_durations:
+            recorder.record(func_key, input_, r_output, durations=durations)
+        else:
+            recorder.record(func_key, input_, r_output)
+
+    if inspect.iscoroutinefunction(func):
+        return functools.wraps(func)(_coroutine_monitor(func, func_key, sample, emit, timing, latency, cache))
+    if inspect.isasyncgenfunction(func) or inspect.isgeneratorfunction(func):
+        item_formatter = output_log_formatter or str
+        monitor = _async_generator_monitor if inspect.isasyncgenfunction(func) else _generator_monitor
+        return functools.wraps(func)(monitor(func, func_key, sample, emit, timing, latency, item_cap, item_formatter))
+
+    @functools.wraps(func)
+    def io_monitor(*args, **kwargs):
+        if cache is not None:
+            call_key = _cache_key(args, kwargs)
+            if call_key is not _MISSING:
+                output = cache.get(func_key, call_key, _MISSING)
+                if output is not _MISSING:
+                    return output
+        durations = None
+        if timing:
+            wall_start, cpu_start = perf_counter_ns(), thread_time_ns()
+            output = func(*args, **kwargs)
+            cpu_ns, wall_ns = thread_time_ns() - cpu_start, perf_counter_ns() - wall_start
+            if latency is not None:
+                latency.observe(func_key, wall_ns)
+            durations = {"wall_ns": wall_ns, "cpu_ns": cpu_ns}
+        elif latency is not None:
+            # the CPU clock is slower to read, and only needed for durations
+            wall_start = perf_counter_ns()
+            output = func(*args, **kwargs)
+            latency.observe(func_key, perf_counter_ns() - wall_start)
+        else:
+            output = func(*args, **kwargs)
+        if cache is not None and call_key is not _MISSING:
+            cache.put(func_key, call_key, output)
+        if recorder is None or (sampler is not None and not sampler.sample(func_key)):
+            return output
+        emit(args, kwargs, output, durations)
         return output
-        
+
     return io_monitor
     
     
-def class_io_monitor(class_instance, record_type=RECORD_TYPES.log, record_fp=None, recorder=None, func_input_log_formatters=None, func_ouput_log_formatters=None):
+def class_io_monitor(class_instance, record_type=RECORD_TYPES.log, record_fp=None, recorder=None, func_input_log_formatters=None, func_ouput_log_formatters=None, timing=False, latency=None, sampler=None, cache=None, item_cap=GENERATOR_ITEM_CAP, **recorder_options):
     """Converts class instance to instance where every component method is I/O monitored.
 
-    The returned class instance has all its methods replaced with monitored versions.
+    The returned class instance has all its methods (instance, class and static methods,
+    including coroutine and generator methods) replaced with monitored versions.
 
     Args:
         class_instance (obj): class instance to convert
+        timing (bool), latency (LatencyHistograms), sampler, cache (CallCache), item_cap (int):
+          see `func_io_monitor()` (a cache is shared by all methods)
+        recorder_options: options of the recorder (see `get_recorder()`)
 
     Returns: (obj) class instance
     """
     # create io monitor methods for every method in class instance
-    if not recorder:
-        recorder = _get_recorder(record_type, record_fp)
+    if not recorder and record_type is not None:
+        recorder = get_recorder(record_type, record_fp, **recorder_options)
+    if cache is True:
+        cache = CallCache()
+    instance_attrs = getattr(class_instance, "__dict__", {})
     wrapped_methods = {}
     for attr in dir(class_instance):
-        if inspect.ismethod(getattr(class_instance, attr)):
-            wrapped_methods[attr] = func_io_monitor(getattr(class_instance, attr), recorder=recorder)
+        if attr in instance_attrs:
+            continue
+        # look up the class attribute without calling descriptors (e.g. properties)
+        static_attr = inspect.getattr_static(type(class_instance), attr, None)
+        if inspect.isfunction(static_attr) or isinstance(static_attr, (staticmethod, classmethod)):
+            wrapped_methods[attr] = func_io_monitor(
+                getattr(class_instance, attr), record_type=record_type, recorder=recorder, timing=timing,
+                latency=latency, sampler=sampler, cache=cache, item_cap=item_cap
+            )
     # replace class instance methods with wrapped monitor versions
     for name, monitor_method in wrapped_methods.items():
         setattr(class_instance, name, monitor_method)  
     return class_instance
       
-      
- # -- Internal --
 
+def get_recorder(record_type=RECORD_TYPES.log, record_fp=None, background=False, queue_size=BACKGROUND_QUEUE_SIZE,
+                 overflow="block", reservoir_size=None, **options):
+    """Create a recorder, e.g. to share between monitors (see `func_io_monitor()`)
 
-def _get_recorder(record_type, record_fp):
-    """ """
+    Args:
+        record_type (RECORD_TYPES): record format
+        record_fp (str): file to record to
+        background (bool): record in a writer thread, which formats and writes calls that
+          monitors add to a bounded queue (the recorder gets 'flush()' and 'close()' methods,
+          and 'dropped' and 'dropped_by_key' counters)
+        queue_size (int): maximum number of queued calls of a background recorder
+        overflow (str): what a background recorder does with a call when its queue is
+          full, one of OVERFLOW_POLICIES: wait until there is room ("block"), drop the call
+          ("drop-newest") or drop the oldest queued call ("drop-oldest")
+        reservoir_size (int): instead of recording every call, keep a uniform random sample
+          of at most this many (unformatted) calls per function key in memory, which is
+          recorded, and replaced by a sample of the following calls, on 'flush()' and
+          'close()' (which is called at exit)
+        options: options of the record type's recorder:
+            all - shard (bool): record to a file per process, "<name>.<pid><ext>" for record_fp
+                "<name><ext>", switching files in forked processes (see `merge_shards()`, binary
+                shards are also read by `BinaryRecordReader`)
+            jsonl - flush_size (int), flush_interval (float): see JSONL_FLUSH_SIZE and
+                JSONL_FLUSH_INTERVAL
+            binary - segment_size (int): see BINARY_SEGMENT_SIZE, compression (str): one of
+                BINARY_COMPRESSIONS, flush_interval (float): see JSONL_FLUSH_INTERVAL
+
+    Returns: recorder, with a 'record(function_key, input_, output)' method (and for the
+      jsonl and binary record types, 'flush()' and 'close()' methods, and 'dropped' and
+      'dropped_by_key' counters of records added after 'close()')
+    """
     if record_type == RECORD_TYPES.log:
-        return _recorder_log(record_fp)
+        recorder = _recorder_log(record_fp, **options)
     elif record_type == RECORD_TYPES.json:
-        return _recorder_json(record_fp)
+        recorder = _recorder_json(record_fp, **options)
+    elif record_type == RECORD_TYPES.jsonl:
+        recorder = _recorder_jsonl(record_fp, **options)
+    elif record_type == RECORD_TYPES.binary:
+        recorder = _recorder_binary(record_fp, **options)
     else:
         raise ValueError("Recorder type not found")
+    if background:
+        recorder = _recorder_background(recorder, queue_size=queue_size, overflow=overflow)
+    if reservoir_size is not None:
+        recorder = _recorder_reservoir(recorder, reservoir_size)
+    return recorder
+
+
+def load_recording(record_fp, record_type=RECORD_TYPES.jsonl):
+    """Load a JSON, JSON lines or binary recording, grouped by function key
+
+    Args:
+        record_fp (str): recording file (for binary recordings, the record_fp they were
+          recorded with)
+        record_type (RECORD_TYPES): record format of the file (json, jsonl or binary)
+
+    Returns: (dict) list of records (dicts with "time", "in" and "out" keys) of each
+      function key, in recording order
+    """
+    if record_type == RECORD_TYPES.json:
+        with open(record_fp, 'r') as fh:
+            return json.load(fh)
+    elif record_type == RECORD_TYPES.jsonl:
+        recording = {}
+        with open(record_fp, 'r') as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                recording.setdefault(record.pop("key"), []).append(record)
+        return recording
+    elif record_type == RECORD_TYPES.binary:
+        recording = {}
+        for record in BinaryRecordReader(record_fp).iter_records():
+            recording.setdefault(record.pop("key"), []).append(record)
+        return recording
+    else:
+        raise ValueError("Recording can not be loaded for record type: {}".format(record_type))
+
+
+class BinaryRecordReader:
+    """Reads the segments of a binary recording (see `get_recorder()`)
+
+    Segments are memory-mapped and only the records that match are decoded.
+    Complete segments are skipped entirely, using their index, if they have no
+    matching records. Compressed segments are decompressed when they are read,
+    and can only be read once complete. The segments of per process shards
+    (see `shard_fps()`) are read with the recording's own, and their records
+    merged in time order.
+    """
+
+    def __init__(self, record_fp, shards=True):
+        """
+        Args:
+            record_fp (str): record_fp the recording was recorded with
+            shards (bool): also read the segments of the recording's shards
+        """
+        self.record_fp = record_fp
+        self.shards = shard_fps(record_fp, record_type=RECORD_TYPES.binary) if shards else []
+        self._segments = [
+            segments for segments in (_segment_fps(fp) for fp in [record_fp] + self.shards) if segments
+        ]
+        self.segments = [fp for segments in self._segments for fp in segments]
+
+    def keys(self):
+        """Function keys of the complete segments (incomplete ones are not indexed)
+
+        Returns: (dict) number of records, and first and last record time, of each function key
+        """
+        keys = {}
+        for fp in self.segments:
+            with open(fp, 'rb') as fh:
+                if os.fstat(fh.fileno()).st_size < _SEGMENT_HEADER.size:
+                    continue
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    footer = _segment_footer(data)[0]
+            for key, (count, first, last) in (footer or {}).get("keys", {}).items():
+                if key in keys:
+                    count, first, last = count + keys[key][0], min(first, keys[key][1]), max(last, keys[key][2])
+                keys[key] = [count, first, last]
+        return {key: {"count": count, "start": first / 1e6, "end": last / 1e6} for key, (count, first, last) in keys.items()}
+
+    def iter_records(self, function_key=None, start=None, end=None):
+        """Iterate the records of a function key in a time range, segment by segment (and
+        shards merged in time order)
+
+        Args:
+            function_key (str): only records of this function key
+            start (float): only records at or after this time (seconds since the epoch)
+            end (float): only records before this time
+
+        Returns: (generator) records (dicts with "key", "time", "in" and "out" keys)
+        """
+        start_us = None if start is None else int(start * 1e6)
+        end_us = None if end is None else int(end * 1e6)
+        streams = [
+            itertools.chain.from_iterable(_segment_records(fp, function_key, start_us, end_us) for fp in segments)
+            for segments in self._segments
+        ]
+        if len(streams) == 1:
+            yield from streams[0]
+        else:
+            yield from heapq.merge(*streams, key=lambda record: record["time"])
+
+
+class EveryNSampler:
+    """Samples every n-th call (starting with the first) of each function key"""
+
+    def __init__(self, n):
+        self.n = n
+        self._counters = defaultdict(itertools.count)
+
+    def sample(self, function_key):
+        """Whether to record a call of function key"""
+        return next(self._counters[function_key]) % self.n == 0
+
+
+class ProbabilitySampler:
+    """Samples each call with a fixed probability"""
+
+    def __init__(self, probability, seed=None):
+        self.probability = probability
+        self._random = random.Random(seed)
+
+    def sample(self, function_key):
+        """Whether to record a call of function key"""
+        return self._random.random() < self.probability
+
+
+class TokenBucketSampler:
+    """Samples at most 'rate' calls per second of each function key
+
+    Each function key has a bucket of at most 'burst' tokens (default: rate, at
+    least 1), refilled at 'rate' tokens per second. A call is sampled if there
+    is a token left, which it takes.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = max(rate, 1) if burst is None else burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def sample(self, function_key):
+        """Whether to record a call of function key"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(function_key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            sampled = tokens >= 1
+            self._buckets[function_key] = (tokens - 1 if sampled else tokens, now)
+        return sampled
+
+
+def shard_fps(record_fp, record_type=RECORD_TYPES.jsonl):
+    """Existing per process shard files of a recording (see `get_recorder()`)
+
+    Args:
+        record_fp (str): recording file the shards were recorded for
+        record_type (RECORD_TYPES): record format of the shards (for binary recordings,
+          the shards are the record_fp of each process' segment files)
+
+    Returns: (list) shard files, sorted
+    """
+    root, ext = os.path.splitext(record_fp)
+    if record_type == RECORD_TYPES.binary:
+        pattern = "{}.[0-9]*{}.[0-9]*".format(glob.escape(root), ext)
+        fps = {fp.rsplit(".", 1)[0] for fp in glob.glob(pattern) if fp.rsplit(".", 1)[1].isdigit()}
+    else:
+        fps = glob.glob("{}.[0-9]*{}".format(glob.escape(root), ext))
+    return sorted(fp for fp in fps if fp[len(root) + 1:len(fp) - len(ext)].isdigit())
+
+
+def merge_shards(record_fp, output_fp, record_type=RECORD_TYPES.jsonl, shards=None, **options):
+    """Merge the per process shard files of a recording into one, in time order
+
+    The records of each shard are expected in time order (as recorded, apart
+    from the order of calls that run concurrently in a process).
+
+    Args:
+        record_fp (str): recording file the shards were recorded for
+        output_fp (str): merged recording file (for binary recordings, the record_fp
+          of the merged segment files)
+        record_type (RECORD_TYPES): record format of the shards (json, jsonl or binary)
+        shards (list): shard files, instead of all existing shards of record_fp
+        options: options of the binary recorder of the merged recording (see `get_recorder()`)
+
+    Returns: (int) number of merged shards
+    """
+    shards = shard_fps(record_fp, record_type=record_type) if shards is None else shards
+    if record_type == RECORD_TYPES.jsonl:
+        files = [open(fp, 'r') for fp in shards]
+        try:
+            streams = [
+                ((json.loads(line)["time"], line if line.endswith("\n") else line + "\n") for line in fh if line.strip())
+                for fh in files
+            ]
+            with open(output_fp, 'w') as out:
+                for _, line in heapq.merge(*streams, key=lambda record: record[0]):
+                    out.write(line)
+        finally:
+            for fh in files:
+                fh.close()
+    elif record_type == RECORD_TYPES.json:
+        recordings = [load_recording(fp, record_type=record_type) for fp in shards]
+        merged = {}
+        for function_key in {key for recording in recordings for key in recording}:
+            merged[function_key] = list(heapq.merge(
+                *(recording.get(function_key, []) for recording in recordings), key=lambda record: record["time"]
+            ))
+        with open(output_fp, 'w') as out:
+            json.dump(merged, out)
+    elif record_type == RECORD_TYPES.binary:
+        recorder = _recorder_binary(output_fp, **options)
+        try:
+            records = heapq.merge(
+                *(BinaryRecordReader(fp, shards=False).iter_records() for fp in shards), key=lambda record: record["time"]
+            )
+            for record in records:
+                function_key, timestamp = record.pop("key"), record.pop("time")
+                input_, output = record.pop("in"), record.pop("out")
+                recorder.record(function_key, input_, output, timestamp=timestamp, durations=record)
+        finally:
+            recorder.close()
+    else:
+        raise ValueError("Shards can not be merged for record type: {}".format(record_type))
+    return len(shards)
+
+
+class CallCache:
+    """LRU cache of call outputs, per function key and input
+
+    Pass to `func_io_monitor()` or `class_io_monitor()` as 'cache'. Inputs are
+    compared like `functools.lru_cache()` does (e.g. 1 and 1.0 are the same
+    input) if they are hashable, or else by their JSON serialization (with
+    sorted keys). Calls with inputs that are neither are not cached.
+
+    Outputs are cached per function key, which does not tell instances of a
+    class apart, so do not share a cache between monitors of different instances.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=None):
+        """
+        Args:
+            maxsize (int): maximum number of cached outputs, or None for no maximum
+            ttl (float): seconds an output stays cached, or None for no limit
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._counters = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def get(self, function_key, call_key, default=None):
+        """Cached output of a call (see `_cache_key()`), or default if it is not cached"""
+        key = (function_key, call_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters[function_key]["misses"] += 1
+                return default
+            output, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                self._counters[function_key]["expirations"] += 1
+                self._counters[function_key]["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._counters[function_key]["hits"] += 1
+            return output
+
+    def put(self, function_key, call_key, output):
+        """Cache the output of a call, evicting the least recently used output if full"""
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[(function_key, call_key)] = (output, expires)
+            self._entries.move_to_end((function_key, call_key))
+            while self.maxsize is not None and len(self._entries) > self.maxsize:
+                (evicted_key, _), _ = self._entries.popitem(last=False)
+                self._counters[evicted_key]["evictions"] += 1
+
+    def warm(self, recording, record_type=RECORD_TYPES.jsonl, output_loader=None):
+        """Cache the recorded outputs of a recording
+
+        Only calls recorded with the default input formatter ({"args": [...], "kwargs":
+        {...}}) are cached. Outputs are cached as recorded (by default, as `str()`).
+
+        Args:
+            recording (str|dict): recording file, or loaded recording (see `load_recording()`)
+            record_type (RECORD_TYPES): record format of the recording file
+            output_loader (func): converts recorded outputs to the cached outputs
+
+        Returns: (int) number of cached outputs
+        """
+        if not isinstance(recording, dict):
+            recording = load_recording(recording, record_type=record_type)
+        cached = 0
+        for function_key, records in recording.items():
+            for record in records:
+                input_ = record.get("in")
+                if not isinstance(input_, dict) or set(input_) != {"args", "kwargs"}:
+                    continue
+                call_key = _cache_key(tuple(input_["args"]), input_["kwargs"])
+                if call_key is _MISSING:
+                    continue
+                output = record.get("out")
+                self.put(function_key, call_key, output_loader(output) if output_loader else output)
+                cached += 1
+        return cached
+
+    def stats(self):
+        """Counters of each function key
+
+        Returns: (dict) "hits", "misses", "evictions" and "expirations" of each function key
+        """
+        with self._lock:
+            return {
+                function_key: {
+                    name: counters[name] for name in ("hits", "misses", "evictions", "expirations")
+                }
+                for function_key, counters in self._counters.items()
+            }
+
+    def clear(self):
+        """Remove all cached outputs (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+
+
+class LatencyHistograms:
+    """Log-bucketed histograms of call durations, per function key
+
+    Pass to `func_io_monitor()` or `class_io_monitor()` as 'latency'. Durations
+    are counted in buckets (see HISTOGRAM_SUB_BUCKET_BITS), so memory use does
+    not grow with the number of calls, and reported percentiles are the upper
+    bound of the bucket the percentile falls in (or the maximum, if lower).
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._dump_thread = None
+        self._stop_dump = threading.Event()
+
+    def observe(self, function_key, duration_ns):
+        """Count a call duration (in nanoseconds) of function key"""
+        bucket = _histogram_bucket(duration_ns)
+        with self._lock:
+            histogram = self._histograms.get(function_key)
+            if histogram is None:
+                histogram = self._histograms[function_key] = _Histogram()
+            histogram.buckets[bucket] = histogram.buckets.get(bucket, 0) + 1
+            histogram.count += 1
+            if duration_ns > histogram.max:
+                histogram.max = duration_ns
+
+    def snapshot(self, reset=False):
+        """Summary of the durations of each function key
+
+        Args:
+            reset (bool): clear the histograms
+
+        Returns: (dict) "count", "max" and percentiles (e.g. "p50", see HISTOGRAM_PERCENTILES),
+          in nanoseconds, of each function key
+        """
+        with self._lock:
+            histograms = self._histograms
+            if reset:
+                self._histograms = {}
+            else:
+                histograms = {key: histogram.copy() for key, histogram in histograms.items()}
+        return {key: histogram.summary() for key, histogram in histograms.items()}
+
+    def dump(self, fp, reset=False):
+        """Append a snapshot, with the time, to a JSON lines file
+
+        Returns: (dict) snapshot (see `snapshot()`)
+        """
+        snapshot = self.snapshot(reset=reset)
+        with open(fp, 'a') as fh:
+            fh.write(json.dumps({"time": time.time(), "latency": snapshot}) + "\n")
+        return snapshot
+
+    def start_periodic_dump(self, interval, fp, reset=False):
+        """Dump (see `dump()`) every interval seconds in a background thread"""
+        if self._dump_thread is not None:
+            raise ValueError("Periodic dump already started")
+        self._stop_dump.clear()
+        self._dump_thread = threading.Thread(
+            target=self._dump_periodically, args=(interval, fp, reset), name="func_io_monitor-latency", daemon=True
+        )
+        self._dump_thread.start()
+
+    def stop_periodic_dump(self):
+        """Stop dumping periodically"""
+        if self._dump_thread is None:
+            return
+        self._stop_dump.set()
+        self._dump_thread.join()
+        self._dump_thread = None
+
+    def _dump_periodically(self, interval, fp, reset):
+        while not self._stop_dump.wait(interval):
+            try:
+                self.dump(fp, reset=reset)
+            except Exception:
+                _LOGGER.exception("Failed to dump latency histograms to %s", fp)
+
+      
+ # -- Internal --
 
         
 class _recorder_log:
     """ """
-    def __init__(self, fp=None):
+    def __init__(self, fp=None, shard=False):
         enabled = True if fp else False
         fp = fp if fp else "fangless"
-        self.log = _get_logger(fp, enabled=enabled, log_level="INFO")
-    def record(self, function_key, input_, output):
-        """ """
-        self.log.info(f"{function_key} - IN: {input_} - OUT: {output}")
+        # a fangless recorder writes nothing, monitors skip it (see `func_io_monitor()`)
+        self.enabled = enabled
+        self.shard = shard and enabled
+        self._base_fp = fp
+        self.fp = _shard_fp(fp) if self.shard else fp
+        # shards are appended to, a process with a recycled pid must not clobber an earlier one's
+        self.log = _get_logger(self.fp, enabled=enabled, log_level="INFO", mode='a' if self.shard else 'w')
+        if self.shard:
+            _FORK_AWARE.add(self)
+    def _after_fork(self):
+        for handler in list(self.log.handlers):
+            if getattr(handler, "baseFilename", None) == os.path.abspath(self.fp):
+                self.log.removeHandler(handler)
+                handler.close()
+        self.fp = _shard_fp(self._base_fp)
+        self.log = _get_logger(self.fp, enabled=True, log_level="INFO", mode='a')
+    def record(self, function_key, input_, output, timestamp=None, durations=None):
+        """ (log records are timestamped, and their message formatted, when they are written) """
+        if durations:
+            self.log.info("%s - IN: %s - OUT: %s - WALL_NS: %s - CPU_NS: %s", function_key, input_, output,
+                          durations['wall_ns'], durations['cpu_ns'])
+        else:
+            self.log.info("%s - IN: %s - OUT: %s", function_key, input_, output)
         
  
 class _recorder_json:
     """ """
-    def __init__(self, fp):
-        self.fp = os.path.abspath(fp)
-    def record(self, function_key, input_, output):
+    def __init__(self, fp, shard=False):
+        self.shard = shard
+        self._base_fp = os.path.abspath(fp)
+        self.fp = _shard_fp(self._base_fp) if shard else self._base_fp
+        if shard:
+            _FORK_AWARE.add(self)
+    def _after_fork(self):
+        self.fp = _shard_fp(self._base_fp)
+    def record(self, function_key, input_, output, timestamp=None, durations=None):
         """ """
         if os.path.isfile(self.fp):
-            e_json = json.load(open(self.fp, 'r'))
+            with open(self.fp, 'r') as fh:
+                e_json = json.load(fh)
         else:
             e_json = {}
         if function_key not in e_json.keys():
             e_json[function_key] = []
-        e_json[function_key].append(
-            {
-                "time": time.time(),
-                "in": input_,
-                "out": output
-            }
-        )
-        json.dump(e_json, open(self.fp, 'w'))
+        entry = {
+            "time": time.time() if timestamp is None else timestamp,
+            "in": input_,
+            "out": output
+        }
+        if durations:
+            entry.update(durations)
+        e_json[function_key].append(entry)
+        with open(self.fp, 'w') as fh:
+            json.dump(e_json, fh)
+
+
+class _recorder_jsonl:
+    """Appends a JSON line per record to a file, through a buffer
+
+    The buffer is written when it holds flush_size records, when a record is
+    added flush_interval seconds after the last write, and on `flush()` and
+    `close()` (which is called at exit). Records added after `close()` are
+    dropped, and counted in 'dropped' and 'dropped_by_key'.
+    """
+    def __init__(self, fp, flush_size=JSONL_FLUSH_SIZE, flush_interval=JSONL_FLUSH_INTERVAL, shard=False):
+        self.shard = shard
+        self._base_fp = os.path.abspath(fp)
+        self.fp = _shard_fp(self._base_fp) if shard else self._base_fp
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._fh = open(self.fp, 'a')
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.dropped_by_key = Counter()
+        _CLOSE_AT_EXIT[next(_CLOSE_ORDER)] = self
+        _FORK_AWARE.add(self)
+    def record(self, function_key, input_, output, timestamp=None, durations=None):
+        """ """
+        entry = {
+            "key": function_key,
+            "time": time.time() if timestamp is None else timestamp,
+            "in": input_,
+            "out": output
+        }
+        if durations:
+            entry.update(durations)
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            if self._fh is None:
+                self.dropped += 1
+                self.dropped_by_key[function_key] += 1
+                return
+            self._buffer.append(line)
+            if len(self._buffer) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+    def flush(self):
+        """Write buffered records to the file"""
+        with self._lock:
+            if self._fh is not None:
+                self._flush()
+    def close(self):
+        """Write buffered records and close the file"""
+        with self._lock:
+            if self._fh is None:
+                return
+            self._flush()
+            self._fh.close()
+            self._fh = None
+    def __del__(self):
+        if getattr(self, "_fh", None) is not None:
+            self.close()
+    def _after_fork(self):
+        # buffered records are the parent's to write (the file object's buffer is always flushed)
+        self._lock = threading.Lock()
+        self._buffer = []
+        if self.shard and self._fh is not None:
+            self._fh.close()
+            self.fp = _shard_fp(self._base_fp)
+            self._fh = open(self.fp, 'a')
+    def _flush(self):
+        if self._buffer:
+            self._fh.write("\n".join(self._buffer) + "\n")
+            self._buffer = []
+        self._fh.flush()
+        self._last_flush = time.monotonic()
     
 
-def _get_logger(fp, enabled=True, log_level="INFO"):
+class _recorder_binary:
+    """Appends length-prefixed binary records to size-rotated segment files
+
+    Function keys are interned per segment (a key record is written before the
+    first call record of a key), timestamps are varint encoded microsecond
+    deltas and input and output are compact JSON. Each segment is complete in
+    itself, so it can be read (and skipped) on its own (see `BinaryRecordReader`).
+    Compressed segments are kept in memory until they are complete. Records
+    added after `close()` are dropped, and counted in 'dropped' and 'dropped_by_key'.
+    """
+    def __init__(self, fp, segment_size=BINARY_SEGMENT_SIZE, compression=None, flush_interval=JSONL_FLUSH_INTERVAL,
+                 shard=False):
+        if compression not in BINARY_COMPRESSIONS:
+            raise ValueError("Compression not found: {}".format(compression))
+        self.shard = shard
+        self._base_fp = os.path.abspath(fp)
+        self.fp = _shard_fp(self._base_fp) if shard else self._base_fp
+        self.segment_size = segment_size
+        self.compression = compression
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.dropped_by_key = Counter()
+        self._fh = None
+        self._open_segment()
+        _CLOSE_AT_EXIT[next(_CLOSE_ORDER)] = self
+        _FORK_AWARE.add(self)
+    def record(self, function_key, input_, output, timestamp=None, durations=None):
+        """ """
+        entry = {"in": input_, "out": output}
+        if durations:
+            entry.update(durations)
+        payload = json.dumps(entry, separators=(",", ":"), default=str).encode()
+        time_us = round((time.time() if timestamp is None else timestamp) * 1e6)
+        with self._lock:
+            if self._fh is None:
+                self.dropped += 1
+                self.dropped_by_key[function_key] += 1
+                return
+            key_id = self._key_ids.get(function_key)
+            if key_id is None:
+                key_id = self._key_ids[function_key] = len(self._key_ids)
+                record = bytearray([_KEY_RECORD])
+                _write_varint(record, key_id)
+                record += function_key.encode()
+                self._append(record)
+            record = bytearray([_CALL_RECORD])
+            _write_varint(record, key_id)
+            _write_varint(record, _zigzag(time_us - self._last_time_us))
+            record += payload
+            self._append(record)
+            self._last_time_us = time_us
+            stats = self._index.get(function_key)
+            if stats is None:
+                self._index[function_key] = [1, time_us, time_us]
+            else:
+                stats[0] += 1
+                stats[1] = min(stats[1], time_us)
+                stats[2] = max(stats[2], time_us)
+            if self._size >= self.segment_size:
+                self._close_segment()
+                self._open_segment()
+            elif self.compression is None and (
+                    len(self._pending) >= BINARY_FLUSH_SIZE
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush()
+    def flush(self):
+        """Write buffered records of an uncompressed segment to its file"""
+        with self._lock:
+            if self._fh is not None and self.compression is None:
+                self._flush()
+    def close(self):
+        """Complete the current segment and close it"""
+        with self._lock:
+            if self._fh is None:
+                return
+            self._close_segment()
+    def __del__(self):
+        if getattr(self, "_fh", None) is not None:
+            self.close()
+    def _after_fork(self):
+        # buffered records are the parent's to write, and the child writes its own segments
+        self._lock = threading.Lock()
+        if self._fh is None:
+            return
+        self._fh.close()
+        if self.shard:
+            self.fp = _shard_fp(self._base_fp)
+        self._open_segment()
+    def _append(self, record):
+        _write_varint(self._pending, len(record))
+        self._pending += record
+        self._size += len(record)
+    def _open_segment(self):
+        self._key_ids = {}
+        self._index = {}
+        self._pending = bytearray()
+        self._size = 0
+        self._last_time_us = int(time.time() * 1e6)
+        self._last_flush = time.monotonic()
+        # segment numbers continue after existing segments, and are claimed by exclusive
+        # creation (so processes writing the same recording do not share segments)
+        number = len(_segment_fps(self.fp))
+        while True:
+            try:
+                self._fh = open("{}.{:06d}".format(self.fp, number), 'xb')
+                break
+            except FileExistsError:
+                number += 1
+        self._fh.write(_SEGMENT_HEADER.pack(
+            _SEGMENT_MAGIC, _SEGMENT_VERSION, BINARY_COMPRESSIONS[self.compression], self._last_time_us
+        ))
+        # the file object's buffer is always flushed, so a forked child can close it
+        self._fh.flush()
+    def _flush(self):
+        self._fh.write(self._pending)
+        self._fh.flush()
+        self._pending = bytearray()
+        self._last_flush = time.monotonic()
+    def _close_segment(self):
+        if self.compression == "zlib":
+            self._pending = bytearray(zlib.compress(bytes(self._pending)))
+        elif self.compression == "lzma":
+            self._pending = bytearray(lzma.compress(bytes(self._pending)))
+        footer = json.dumps({"keys": self._index}, separators=(",", ":")).encode()
+        self._pending += footer + _FOOTER_LENGTH.pack(len(footer)) + _FOOTER_MAGIC
+        self._flush()
+        self._fh.close()
+        self._fh = None
+
+
+class _recorder_background:
+    """Records calls in a writer thread, from a bounded queue
+
+    Monitors add calls unformatted (see `record_call()`), so formatting the
+    input and output and writing them is done by the writer thread. Calls
+    dropped on overflow or added after `close()` are counted in 'dropped' and
+    'dropped_by_key'.
+    """
+    def __init__(self, recorder, queue_size=BACKGROUND_QUEUE_SIZE, overflow="block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Overflow policy not found: {}".format(overflow))
+        self.recorder = recorder
+        self.overflow = overflow
+        self.dropped = 0
+        self.dropped_by_key = Counter()
+        self._record = _call_recorder(recorder, formatted=True)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._start()
+        _CLOSE_AT_EXIT[next(_CLOSE_ORDER)] = self
+        _FORK_AWARE.add(self)
+    def record(self, function_key, input_, output):
+        """ """
+        self.record_call(_Call(function_key, time.time(), (input_,), {}, output, _as_is, _as_is))
+    def record_call(self, call):
+        """Queue an unformatted call (see `_Call`) for the writer thread"""
+        if self._closed:
+            self._count_drop(call)
+            return
+        if self.overflow == "block":
+            self._queue.put(call)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(call)
+                return
+            except queue.Full:
+                if self.overflow == "drop-newest":
+                    self._count_drop(call)
+                    return
+            # drop-oldest
+            try:
+                oldest = self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            self._queue.task_done()
+            self._count_drop(oldest)
+    def flush(self):
+        """Wait until all queued calls are written, then flush the recorder"""
+        self._queue.join()
+        if hasattr(self.recorder, "flush"):
+            self.recorder.flush()
+    def close(self):
+        """Write all queued calls, stop the writer thread and close the recorder"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        if hasattr(self.recorder, "close"):
+            self.recorder.close()
+    def _start(self):
+        self._thread = threading.Thread(target=self._write, name="func_io_monitor-writer", daemon=True)
+        self._thread.start()
+    def _after_fork(self):
+        # the writer thread does not exist in the child, and queued calls are the parent's to write
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        if not self._closed:
+            self._start()
+    def _count_drop(self, call):
+        with self._lock:
+            self.dropped += 1
+            self.dropped_by_key[call.function_key] += 1
+    def _write(self):
+        while True:
+            call = self._queue.get()
+            try:
+                if call is None:
+                    return
+                self._record(call)
+            except Exception:
+                _LOGGER.exception("Failed to record call of %s", call.function_key)
+            finally:
+                self._queue.task_done()
+
+
+class _recorder_reservoir:
+    """Keeps a uniform random sample of at most 'size' calls per function key
+
+    Reservoir sampling: the n-th call of a function key replaces a random kept
+    call with probability size / n. Calls are kept unformatted, and recorded
+    (in call order) on `flush()` and `close()`, which start a new sample.
+    """
+    def __init__(self, recorder, size, seed=None):
+        self.recorder = recorder
+        self.size = size
+        self._record = _call_recorder(recorder)
+        self._random = random.Random(seed)
+        self._reservoirs = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        _CLOSE_AT_EXIT[next(_CLOSE_ORDER)] = self
+        _FORK_AWARE.add(self)
+    def record(self, function_key, input_, output):
+        """ """
+        self.record_call(_Call(function_key, time.time(), (input_,), {}, output, _as_is, _as_is))
+    def record_call(self, call):
+        """Keep call if it is sampled"""
+        with self._lock:
+            reservoir = self._reservoirs.get(call.function_key)
+            if reservoir is None:
+                reservoir = self._reservoirs[call.function_key] = [0, []]
+            reservoir[0] += 1
+            calls = reservoir[1]
+            if len(calls) < self.size:
+                calls.append(call)
+            else:
+                idx = self._random.randrange(reservoir[0])
+                if idx < self.size:
+                    calls[idx] = call
+    def flush(self):
+        """Record the kept calls and start a new sample"""
+        with self._lock:
+            reservoirs, self._reservoirs = self._reservoirs, {}
+        for call in sorted((call for _, calls in reservoirs.values() for call in calls), key=lambda call: call.timestamp):
+            self._record(call)
+        if hasattr(self.recorder, "flush"):
+            self.recorder.flush()
+    def _after_fork(self):
+        # kept calls are the parent's to record
+        self._lock = threading.Lock()
+        self._reservoirs = {}
+    def close(self):
+        """Record the kept calls and close the recorder"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.flush()
+        if hasattr(self.recorder, "close"):
+            self.recorder.close()
+    def __del__(self):
+        if not getattr(self, "_closed", True):
+            self.close()
+
+
+class _Call:
+    """A monitored call, with its input and output formatted on demand"""
+    __slots__ = (
+        "function_key", "timestamp", "args", "kwargs", "output", "input_formatter", "output_formatter", "durations"
+    )
+    def __init__(self, function_key, timestamp, args, kwargs, output, input_formatter=None, output_formatter=None,
+                 durations=None):
+        self.function_key = function_key
+        self.timestamp = timestamp
+        self.args = args
+        self.kwargs = kwargs
+        self.output = output
+        self.input_formatter = input_formatter
+        self.output_formatter = output_formatter
+        self.durations = durations
+    def format(self):
+        """Format input and output as `func_io_monitor()` does"""
+        if self.input_formatter:
+            input_ = self.input_formatter(*self.args, **self.kwargs)
+        else:
+            # default - json structured str
+            input_ = {"args": self.args, "kwargs": self.kwargs}
+        if self.output_formatter:
+            output = self.output_formatter(self.output)
+        else:
+            # default - convert to str
+            output = str(self.output)
+        return input_, output
+
+
+def _coroutine_monitor(func, func_key, sample, emit, timing, latency, cache):
+    """Monitor of a coroutine function (see `func_io_monitor()`)"""
+    async def io_monitor(*args, **kwargs):
+        if cache is not None:
+            call_key = _cache_key(args, kwargs)
+            if call_key is not _MISSING:
+                output = cache.get(func_key, call_key, _MISSING)
+                if output is not _MISSING:
+                    return output
+        durations = None
+        if timing:
+            durations = {"wall_ns": 0, "cpu_ns": 0}
+            wall_start = perf_counter_ns()
+            output = await _cpu_timed(func(*args, **kwargs), durations)
+            durations["wall_ns"] = perf_counter_ns() - wall_start
+            if latency is not None:
+                latency.observe(func_key, durations["wall_ns"])
+        elif latency is not None:
+            wall_start = perf_counter_ns()
+            output = await func(*args, **kwargs)
+            latency.observe(func_key, perf_counter_ns() - wall_start)
+        else:
+            output = await func(*args, **kwargs)
+        if cache is not None and call_key is not _MISSING:
+            cache.put(func_key, call_key, output)
+        if sample():
+            emit(args, kwargs, output, durations)
+        return output
+
+    return io_monitor
+
+
+def _generator_monitor(func, func_key, sample, emit, timing, latency, item_cap, item_formatter):
+    """Monitor of a generator function (see `func_io_monitor()`)
+
+    Values and exceptions sent or thrown into the monitor are passed on to the generator.
+    """
+    def io_monitor(*args, **kwargs):
+        generator = func(*args, **kwargs)
+        recording = sample()
+        if not recording and not timing and latency is None:
+            return (yield from generator)
+        items, count, returned = [], 0, None
+        durations = {"wall_ns": 0, "cpu_ns": 0}
+        value = error = None
+        while True:
+            wall_start = perf_counter_ns()
+            cpu_start = thread_time_ns() if timing else 0
+            try:
+                item = generator.send(value) if error is None else generator.throw(error)
+            except StopIteration as stop:
+                returned = stop.value
+                break
+            finally:
+                durations["wall_ns"] += perf_counter_ns() - wall_start
+                if timing:
+                    durations["cpu_ns"] += thread_time_ns() - cpu_start
+            count += 1
+            if recording and len(items) < item_cap:
+                items.append(item_formatter(item))
+            value = error = None
+            try:
+                value = yield item
+            except GeneratorExit:
+                # closed by the consumer (or garbage collected) before the stream was exhausted
+                generator.close()
+                break
+            except BaseException as exc:
+                error = exc
+        if latency is not None:
+            latency.observe(func_key, durations["wall_ns"])
+        if recording:
+            emit(args, kwargs, {"items": items, "count": count}, durations if timing else None, _as_is)
+        return returned
+
+    return io_monitor
+
+
+def _async_generator_monitor(func, func_key, sample, emit, timing, latency, item_cap, item_formatter):
+    """Monitor of an async generator function (see `func_io_monitor()`)
+
+    Values and exceptions sent or thrown into the monitor are passed on to the generator.
+    """
+    async def io_monitor(*args, **kwargs):
+        generator = func(*args, **kwargs)
+        recording = sample()
+        items, count = [], 0
+        durations = {"wall_ns": 0, "cpu_ns": 0}
+        value = error = None
+        while True:
+            step = generator.asend(value) if error is None else generator.athrow(error)
+            wall_start = perf_counter_ns()
+            try:
+                item = await (_cpu_timed(step, durations) if timing else step)
+            except StopAsyncIteration:
+                break
+            finally:
+                durations["wall_ns"] += perf_counter_ns() - wall_start
+            count += 1
+            if recording and len(items) < item_cap:
+                items.append(item_formatter(item))
+            value = error = None
+            try:
+                value = yield item
+            except GeneratorExit:
+                # closed by the consumer (or finalized by the event loop) before the stream was exhausted
+                await generator.aclose()
+                break
+            except BaseException as exc:
+                error = exc
+        if latency is not None:
+            latency.observe(func_key, durations["wall_ns"])
+        if recording:
+            emit(args, kwargs, {"items": items, "count": count}, durations if timing else None, _as_is)
+
+    return io_monitor
+
+
+@types.coroutine
+def _cpu_timed(awaitable, durations):
+    """Await a coroutine (or other awaitable with 'send()' and 'throw()'), adding the CPU
+    time of the calling thread while it runs to durations["cpu_ns"]
+
+    The time while it is suspended (e.g. waiting for I/O, when other tasks run) is not added.
+    """
+    value = error = None
+    while True:
+        cpu_start = thread_time_ns()
+        try:
+            yielded = awaitable.send(value) if error is None else awaitable.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            durations["cpu_ns"] += thread_time_ns() - cpu_start
+        value = error = None
+        try:
+            value = yield yielded
+        except GeneratorExit:
+            awaitable.close()
+            raise
+        except BaseException as exc:
+            error = exc
+
+
+def _as_is(value):
+    """Formatter for values that are already formatted"""
+    return value
+
+
+class _Histogram:
+    """Bucket counts of the durations of one function key (see `LatencyHistograms`)"""
+    __slots__ = ("buckets", "count", "max")
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.max = 0
+    def copy(self):
+        histogram = _Histogram()
+        histogram.buckets = dict(self.buckets)
+        histogram.count = self.count
+        histogram.max = self.max
+        return histogram
+    def summary(self):
+        summary = {"count": self.count}
+        ranks = [(percentile, self.count * percentile / 100) for percentile in HISTOGRAM_PERCENTILES]
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            while ranks and seen >= ranks[0][1]:
+                summary["p{}".format(ranks.pop(0)[0])] = min(_histogram_bucket_bound(bucket), self.max)
+        summary["max"] = self.max
+        return summary
+
+
+def _histogram_bucket(value):
+    """Bucket index of a (non negative integer) value (see HISTOGRAM_SUB_BUCKET_BITS)"""
+    exponent = value.bit_length() - 1
+    if exponent <= HISTOGRAM_SUB_BUCKET_BITS:
+        return value
+    shift = exponent - HISTOGRAM_SUB_BUCKET_BITS
+    return (shift << HISTOGRAM_SUB_BUCKET_BITS) + (value >> shift)
+
+
+def _histogram_bucket_bound(bucket):
+    """Largest value in a bucket (see `_histogram_bucket()`)"""
+    sub_buckets = 1 << HISTOGRAM_SUB_BUCKET_BITS
+    if bucket < 2 * sub_buckets:
+        return bucket
+    shift = (bucket >> HISTOGRAM_SUB_BUCKET_BITS) - 1
+    return ((bucket - (shift << HISTOGRAM_SUB_BUCKET_BITS) + 1) << shift) - 1
+
+
+def _function_key(func):
+    """Function key of a function or method, "<module>.<class>.<name>" ("<none>" for the
+    class of functions that are not defined in a class, and of builtins bound to a module)"""
+    owner = getattr(func, "__self__", None)
+    if owner is None or inspect.ismodule(owner):
+        # functions defined in a class (e.g. static methods) are keyed by the class
+        class_name = getattr(func, "__qualname__", func.__name__).rpartition(".")[0]
+        if not class_name or class_name.endswith("<locals>"):
+            class_name = "<none>"
+        return ".".join([str(func.__module__), class_name, func.__name__])
+    # methods bound to a class (classmethods) are keyed by the class, as instance methods are
+    owner_class = owner if isinstance(owner, type) else type(owner)
+    return ".".join([owner_class.__module__, owner_class.__qualname__, func.__name__])
+
+
+def _cache_key(args, kwargs):
+    """Key of a call's input in a `CallCache`, or _MISSING if it can not be cached"""
+    key = (args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        pass
+    try:
+        return json.dumps([args, kwargs], sort_keys=True)
+    except (TypeError, ValueError):
+        return _MISSING
+
+
+def _call_recorder(recorder, formatted=False):
+    """Function that records a call (see `_Call`) with recorder
+
+    Calls are passed on unformatted to recorders with a 'record_call()' method,
+    unless formatted, and are otherwise formatted and passed to 'record()', with
+    the timestamp and durations if it takes them.
+    """
+    if not formatted and hasattr(recorder, "record_call"):
+        return recorder.record_call
+    timestamps = _accepts_keyword(recorder, "timestamp")
+    durations = _accepts_keyword(recorder, "durations")
+
+    def record(call):
+        input_, output = call.format()
+        keywords = {}
+        if timestamps:
+            keywords["timestamp"] = call.timestamp
+        if durations and call.durations:
+            keywords["durations"] = call.durations
+        recorder.record(call.function_key, input_, output, **keywords)
+
+    return record
+
+
+def _accepts_keyword(recorder, keyword):
+    """Whether recorder.record() takes a keyword (custom recorders may not)"""
+    try:
+        parameters = inspect.signature(recorder.record).parameters
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return keyword in parameters or any(
+        parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values()
+    )
+
+
+def _segment_fps(record_fp):
+    """Existing segment files of a binary recording, in order"""
+    pattern = "{}.[0-9]*".format(glob.escape(record_fp))
+    return sorted(fp for fp in glob.glob(pattern) if fp[len(record_fp) + 1:].isdigit())
+
+
+def _segment_footer(data):
+    """Index of a complete segment and the end of its records, or None and the end of data"""
+    size = len(data)
+    if size < _SEGMENT_HEADER.size + _FOOTER_LENGTH.size + len(_FOOTER_MAGIC) or data[size - 4:size] != _FOOTER_MAGIC:
+        return None, size
+    footer_end = size - len(_FOOTER_MAGIC) - _FOOTER_LENGTH.size
+    (footer_length,) = _FOOTER_LENGTH.unpack_from(data, footer_end)
+    return json.loads(bytes(data[footer_end - footer_length:footer_end])), footer_end - footer_length
+
+
+def _segment_records(fp, function_key, start_us, end_us):
+    """Matching records of a binary segment (see `BinaryRecordReader.iter_records()`)"""
+    with open(fp, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size < _SEGMENT_HEADER.size:
+            return
+        data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, compression, time_us = _SEGMENT_HEADER.unpack_from(data, 0)
+        if magic != _SEGMENT_MAGIC or version != _SEGMENT_VERSION:
+            raise ValueError("Not a binary recording segment: {}".format(fp))
+        footer, end = _segment_footer(data)
+        if footer is not None:
+            keys = footer["keys"] if function_key is None else {
+                function_key: footer["keys"][function_key]
+            } if function_key in footer["keys"] else {}
+            if not any(
+                (start_us is None or last >= start_us) and (end_us is None or first < end_us)
+                for _, first, last in keys.values()
+            ):
+                return
+        pos = _SEGMENT_HEADER.size
+        if compression:
+            if footer is None:
+                # compressed segments are written when complete
+                return
+            body = bytes(data[pos:end])
+            data.close()
+            data = zlib.decompress(body) if compression == BINARY_COMPRESSIONS["zlib"] else lzma.decompress(body)
+            pos, end = 0, len(data)
+
+        keys = {}
+        while pos < end:
+            try:
+                length, pos = _read_varint(data, pos)
+            except IndexError:
+                break
+            record_end = pos + length
+            if record_end > end:
+                # an incomplete record of a segment that is being written
+                break
+            kind = data[pos]
+            key_id, pos = _read_varint(data, pos + 1)
+            if kind == _KEY_RECORD:
+                keys[key_id] = bytes(data[pos:record_end]).decode()
+                pos = record_end
+                continue
+            delta, pos = _read_varint(data, pos)
+            time_us += _unzigzag(delta)
+            key = keys[key_id]
+            if ((function_key is None or key == function_key)
+                    and (start_us is None or time_us >= start_us)
+                    and (end_us is None or time_us < end_us)):
+                record = {"key": key, "time": time_us / 1e6}
+                record.update(json.loads(bytes(data[pos:record_end])))
+                yield record
+            pos = record_end
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def _write_varint(buffer, value):
+    """Append a non negative integer to buffer as a (LEB128) varint"""
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data, pos):
+    """Read a varint at pos in data, returning it and the position after it"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _zigzag(value):
+    """Map an integer to a non negative one, small in magnitude to small"""
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _shard_fp(fp):
+    """Shard file of the current process for a recording file (see `get_recorder()`)"""
+    root, ext = os.path.splitext(fp)
+    return "{}.{}{}".format(root, os.getpid(), ext)
+
+
+def _after_fork():
+    """Reset the recorders in a forked child process (threads, locks, buffers and shards)"""
+    for recorder in list(_FORK_AWARE):
+        recorder._after_fork()
+
+
+def _close_recorders():
+    """Close the open recorders at exit, newest first (so wrapping recorders close before the ones they wrap)"""
+    for _, recorder in sorted(_CLOSE_AT_EXIT.items(), reverse=True):
+        recorder.close()
+
+
+atexit.register(_close_recorders)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _get_logger(fp, enabled=True, log_level="INFO", mode='w'):
     """Create a logger that outputs to supplied filepath
     Args:
         enabled (bool): Whether logging is enabled. This function is called
@@ -192,6 +1730,7 @@ def _get_logger(fp, enabled=True, log_level="INFO"):
             scripts this utility blindly.
         fp (str): filename of the log
         log_level (str): Python logging level to set
+        mode (str): mode to open the log file with
         
     Returns:
         (logging.logger) logging handle
@@ -204,11 +1743,56 @@ def _get_logger(fp, enabled=True, log_level="INFO"):
     
     if enabled:
         # set filehandler
-        fh = logging.FileHandler(fp, mode='w')
+        fh = logging.FileHandler(fp, mode=mode)
         fh.setFormatter(formatter)
         fh.setLevel(getattr(logging, log_level.upper()))
         logger.addHandler(fh)
 
     return logger
-     
 
+
+def _get_argparser():
+    """to organize and clean format argparser args"""
+    parser = argparse.ArgumentParser(
+        description="Merge the per process shard files of a recording into one, in time order"
+    )
+
+    parser.add_argument(
+        "record_fp",
+        action="store",
+        help="recording file the shards were recorded for"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        dest="output",
+        required=True,
+        help="merged recording file"
+    )
+
+    parser.add_argument(
+        "-t",
+        "--record-type",
+        action="store",
+        dest="record_type",
+        choices=["json", "jsonl", "binary"],
+        default="jsonl",
+        help="record format of the shards"
+    )
+    return parser
+
+
+def main():
+    parser = _get_argparser()
+
+    # parse all args and put in dict
+    args = vars(parser.parse_args())
+
+    merged = merge_shards(args["record_fp"], args["output"], record_type=RECORD_TYPES[args["record_type"]])
+    sys.stderr.write("merged {} shards\n".format(merged))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+--- Purpose
+Measure the per call overhead of `func_io_monitor` wrappers, in nanoseconds per
+call, for a trivial function:
+  - unwrapped (the baseline)
+  - disabled (a "fangless" log recorder, which writes nothing)
+  - sampled (1 in 100 calls recorded to JSON lines)
+  - full (every call recorded to JSON lines)
+  - background (every call recorded to JSON lines, in a writer thread)
+  - timing (no recording, call durations collected in latency histograms)
+
+Results are written as JSON so a later run can be compared against them.
+
+--- Usage
+>>python func_io_monitor_bench.py -n 100000 -o baseline.json
+>>python func_io_monitor_bench.py -n 100000 --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from time import perf_counter_ns
+
+from func_io_monitor import RECORD_TYPES, EveryNSampler, LatencyHistograms, func_io_monitor, get_recorder
+
+
+def add(x, y):
+    return x + y
+
+
+def get_cases(directory):
+    """Benchmark cases, as tuples of name and a function that creates the monitored function"""
+    def jsonl_fp(name):
+        return os.path.join(directory, name + ".jsonl")
+
+    return [
+        ("unwrapped", lambda: add),
+        ("disabled", lambda: func_io_monitor(add)),
+        ("sampled", lambda: func_io_monitor(
+            add, record_type=RECORD_TYPES.jsonl, record_fp=jsonl_fp("sampled"), sampler=EveryNSampler(100)
+        )),
+        ("full", lambda: func_io_monitor(add, record_type=RECORD_TYPES.jsonl, record_fp=jsonl_fp("full"))),
+        ("background", lambda: func_io_monitor(add, recorder=get_recorder(
+            RECORD_TYPES.jsonl, jsonl_fp("background"), background=True, overflow="drop-newest"
+        ))),
+        ("timing", lambda: func_io_monitor(add, record_type=None, latency=LatencyHistograms())),
+    ]
+
+
+def run_case(func, calls, repeat):
+    """Time calls of func, best of repeat runs
+
+    Returns: (float) nanoseconds per call
+    """
+    best = None
+    for _ in range(repeat):
+        start = perf_counter_ns()
+        for idx in range(calls):
+            func(idx, 1)
+        elapsed = perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / calls
+
+
+def compare(results, baseline):
+    """Write the ratio of each case's ns/call to the baseline's to stderr"""
+    for name, result in results["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        baseline_ns = baseline["cases"][name]["ns_per_call"]
+        sys.stderr.write("{:<12} {:>10.1f}ns {:>10.1f}ns {:>7.2f}x\n".format(
+            name, baseline_ns, result["ns_per_call"], result["ns_per_call"] / baseline_ns
+        ))
+
+
+def _get_argparser():
+    """to organize and clean format argparser args"""
+    parser = argparse.ArgumentParser(
+        description="Measure the per call overhead of func_io_monitor wrappers"
+    )
+
+    parser.add_argument("-n", "--calls", action="store", dest="calls", type=int, default=100000,
+                        help="number of calls per run")
+    parser.add_argument("-r", "--repeat", action="store", dest="repeat", type=int, default=5,
+                        help="number of timed runs per case (the best is reported)")
+    parser.add_argument("-o", "--output", action="store", dest="output", default=None,
+                        help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", action="store", dest="compare", default=None,
+                        help="JSON results of an earlier run to compare against")
+    return parser
+
+
+def main():
+    parser = _get_argparser()
+
+    # parse all args and put in dict
+    args = vars(parser.parse_args())
+
+    results = {"python": platform.python_version(), "calls": args["calls"], "cases": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        baseline_ns = None
+        for name, create in get_cases(directory):
+            ns_per_call = run_case(create(), args["calls"], args["repeat"])
+            if baseline_ns is None:
+                baseline_ns = ns_per_call
+            results["cases"][name] = {"ns_per_call": ns_per_call, "overhead_ns": ns_per_call - baseline_ns}
+
+    if args["output"]:
+        with open(args["output"], 'w') as fh:
+            json.dump(results, fh, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+    if args["compare"]:
+        with open(args["compare"], 'r') as fh:
+            compare(results, json.load(fh))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+--- Purpose
+Replay a `func_io_monitor` recording (JSON, JSON lines or binary), to use
+recorded calls as unit test data or as a repeatable performance benchmark.
+
+Each recorded call is re-invoked with its recorded input, its output is checked
+against the recorded output and its duration is collected per function key.
+
+The function of each record is resolved from its function key: module level
+functions ("<module>.<none>.<function>") are imported, and methods
+("<module>.<class>.<method>") are called on an instance of the class created
+without arguments. Use 'targets' to supply functions or instances for keys that
+can not be resolved that way, and 'modules' to map recorded module names (e.g.
+"__main__") to importable ones.
+
+Only calls recorded with the default input formatter ({"args": [...], "kwargs":
+{...}}) can be replayed, with their JSON round tripped arguments. Outputs are
+compared as recorded by the default output formatter (`str()`), or with the
+supplied 'output_formatter'.
+
+Coroutines are awaited, and generators and async generators are consumed as far
+as the recorded stream was (its recorded "count" of items), so their outputs are
+compared with the recorded {"items": [...], "count": n} and their latency is the
+time of the whole await or stream.
+
+--- Usage
+>>from func_io_monitor_replay import replay
+>>replay("add_monitor.jsonl", modules={"__main__": "arith"})
+>>{'__main__.<none>.add': {'calls': 1, 'mismatches': 0, 'errors': 0, 'skipped': 0, 'unresolved': 0,
+>>                         'latency': {'count': 1, 'p50': 1151, 'p90': 1151, 'p99': 1151, 'max': 1151}}}
+
+>>python func_io_monitor_replay.py add_monitor.jsonl -m __main__=arith -r 10 -o baseline.json
+>>python func_io_monitor_replay.py add_monitor.jsonl -m __main__=arith -r 10 --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import importlib
+import inspect
+import json
+import sys
+from time import perf_counter_ns
+
+from func_io_monitor import RECORD_TYPES, LatencyHistograms, load_recording
+
+
+def replay(recording, targets=None, modules=None, record_type=RECORD_TYPES.jsonl, repeat=1, output_formatter=str,
+           loop=None):
+    """Re-invoke the recorded calls of a recording
+
+    Args:
+        recording (str|dict): recording file, or loaded recording (see `load_recording()`)
+        targets (dict): function, or class instance, for function keys (or their
+          "<module>.<class>" part) that can not be resolved from the key
+        modules (dict): module to import for recorded module names
+        record_type (RECORD_TYPES): record format of the recording file
+        repeat (int): number of times to replay the recording
+        output_formatter (func): formats outputs (and items of generators) to compare with
+          the recorded outputs
+        loop (asyncio.AbstractEventLoop): event loop to run coroutines and async generators
+          in. Default is a new event loop for the replay.
+
+    Returns: (dict) for each function key, the number of replayed "calls", output
+      "mismatches", calls that raised "errors", records that were "skipped" (because
+      their input can not be replayed) or "unresolved" (because the function can not
+      be resolved, see "resolve_error") and their "latency" (see `LatencyHistograms`)
+    """
+    if not isinstance(recording, dict):
+        recording = load_recording(recording, record_type=record_type)
+    targets = targets or {}
+    modules = modules or {}
+    latency = LatencyHistograms()
+    own_loop = loop is None
+    if own_loop:
+        loop = asyncio.new_event_loop()
+    try:
+        results = _replay(recording, targets, modules, repeat, output_formatter, loop, latency)
+    finally:
+        if own_loop:
+            loop.close()
+
+    snapshot = latency.snapshot()
+    for function_key, result in results.items():
+        result["latency"] = snapshot.get(function_key, {"count": 0})
+    return results
+
+
+def _replay(recording, targets, modules, repeat, output_formatter, loop, latency):
+    """Replay the records of each function key of a recording (see `replay()`)"""
+    results = {}
+    for function_key, records in recording.items():
+        result = results[function_key] = {"calls": 0, "mismatches": 0, "errors": 0, "skipped": 0, "unresolved": 0}
+        try:
+            func = resolve_function(function_key, targets=targets, modules=modules)
+        except (ImportError, AttributeError, TypeError, ValueError) as e:
+            result["unresolved"] = len(records) * repeat
+            result["resolve_error"] = "{}: {}".format(type(e).__name__, e)
+            continue
+        for _ in range(repeat):
+            for record in records:
+                input_ = record.get("in")
+                if not isinstance(input_, dict) or set(input_) != {"args", "kwargs"}:
+                    result["skipped"] += 1
+                    continue
+                result["calls"] += 1
+                start = perf_counter_ns()
+                try:
+                    output = func(*input_["args"], **input_["kwargs"])
+                    if inspect.isawaitable(output):
+                        output = output_formatter(loop.run_until_complete(output))
+                    elif inspect.isgenerator(output):
+                        output = _consume(output, record.get("out"), output_formatter)
+                    elif inspect.isasyncgen(output):
+                        output = loop.run_until_complete(_consume_async(output, record.get("out"), output_formatter))
+                    else:
+                        output = output_formatter(output)
+                except Exception:
+                    latency.observe(function_key, perf_counter_ns() - start)
+                    result["errors"] += 1
+                    continue
+                latency.observe(function_key, perf_counter_ns() - start)
+                if output != record.get("out"):
+                    result["mismatches"] += 1
+    return results
+
+
+def _stream_limits(recorded):
+    """Number of items to consume of a stream, and to format, for its recorded output"""
+    if isinstance(recorded, dict) and isinstance(recorded.get("items"), list):
+        return recorded.get("count"), len(recorded["items"])
+    # not recorded as a stream, so it is consumed in full (and does not match)
+    return None, 0
+
+
+def _consume(generator, recorded, output_formatter):
+    """Consume a generator as far as its recorded stream was consumed
+
+    Returns: (dict) {"items": [...], "count": n}, as recorded by a generator monitor
+    """
+    limit, item_cap = _stream_limits(recorded)
+    items, count = [], 0
+    try:
+        while count != limit:
+            try:
+                item = next(generator)
+            except StopIteration:
+                break
+            count += 1
+            if len(items) < item_cap:
+                items.append(output_formatter(item))
+    finally:
+        generator.close()
+    return {"items": items, "count": count}
+
+
+async def _consume_async(generator, recorded, output_formatter):
+    """Consume an async generator as far as its recorded stream was consumed (see `_consume()`)"""
+    limit, item_cap = _stream_limits(recorded)
+    items, count = [], 0
+    try:
+        while count != limit:
+            try:
+                item = await generator.__anext__()
+            except StopAsyncIteration:
+                break
+            count += 1
+            if len(items) < item_cap:
+                items.append(output_formatter(item))
+    finally:
+        await generator.aclose()
+    return {"items": items, "count": count}
+
+
+def resolve_function(function_key, targets=None, modules=None):
+    """Resolve the function of a recorded function key (see `replay()`)
+
+    Returns: (func) function, or bound method
+    """
+    targets = targets or {}
+    modules = modules or {}
+    if function_key in targets:
+        return targets[function_key]
+
+    owner_key, name = function_key.rsplit(".", 1)
+    if owner_key in targets:
+        return getattr(targets[owner_key], name)
+    module_name, class_name = owner_key.rsplit(".", 1)
+    module = importlib.import_module(modules.get(module_name, module_name))
+    if class_name == "<none>":
+        return getattr(module, name)
+    return getattr(getattr(module, class_name)(), name)
+
+
+def compare(results, baseline):
+    """Write the ratio of each function key's median latency to the baseline's to stderr"""
+    for function_key, result in results.items():
+        if function_key not in baseline or "p50" not in result["latency"]:
+            continue
+        baseline_p50 = baseline[function_key]["latency"].get("p50")
+        if not baseline_p50:
+            continue
+        sys.stderr.write("{:<40} {:>12}ns {:>12}ns {:>7.2f}x\n".format(
+            function_key, baseline_p50, result["latency"]["p50"], result["latency"]["p50"] / baseline_p50
+        ))
+
+
+def _get_argparser():
+    """to organize and clean format argparser args"""
+    parser = argparse.ArgumentParser(
+        description="Replay a func_io_monitor recording and report per function latency"
+    )
+
+    parser.add_argument("recording", action="store",
+                        help="recording file")
+    parser.add_argument("-t", "--record-type", action="store", dest="record_type", choices=["json", "jsonl", "binary"],
+                        default="jsonl", help="record format of the recording")
+    parser.add_argument("-m", "--module", action="append", dest="modules", default=[],
+                        help="module to import for a recorded module name, as <recorded>=<module>")
+    parser.add_argument("-p", "--path", action="append", dest="paths", default=[],
+                        help="directory to add to the module search path")
+    parser.add_argument("-r", "--repeat", action="store", dest="repeat", type=int, default=1,
+                        help="number of times to replay the recording")
+    parser.add_argument("-o", "--output", action="store", dest="output", default=None,
+                        help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", action="store", dest="compare", default=None,
+                        help="JSON results of an earlier run to compare against")
+    return parser
+
+
+def main():
+    parser = _get_argparser()
+
+    # parse all args and put in dict
+    args = vars(parser.parse_args())
+
+    sys.path[:0] = args["paths"]
+    modules = dict(module.split("=", 1) for module in args["modules"])
+    results = replay(
+        args["recording"], modules=modules, record_type=RECORD_TYPES[args["record_type"]], repeat=args["repeat"]
+    )
+
+    if args["output"]:
+        with open(args["output"], 'w') as fh:
+            json.dump(results, fh, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+    if args["compare"]:
+        with open(args["compare"], 'r') as fh:
+            compare(results, json.load(fh))
+
+
+if __name__ == "__main__":
+    main()
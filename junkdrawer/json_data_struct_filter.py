@@ -4,14 +4,87 @@ data instances and then applies filters (specified by simple filter format) to t
 Filters can be supplied to filter out matching instances or filter in matching instances.
 The filters can be for string matches, substring check (via python "in"), re.search pattern
 or re.match pattern. Filters may also be flagged to be applied separately as a set
-(i.e. compound filter).
+(i.e. compound filter), or combined into nested "and"/"or"/"not" expressions.
+
+Filters may be compiled once with `compile_filters()` into a `FilterPlan` that
+can then be applied to any number of data sets without re-parsing field paths
+or re-compiling regex patterns on every call. Filters on the same field are
+evaluated together: many "in" filters through a single Aho-Corasick automaton
+and regex filters through a single combined regex (when not compound, and only
+if it is measured to be faster than separate regexes). Large data sets can
+be filtered across multiple processes with the 'workers' or 'executor' args. Per
+filter evaluation counts, hit rates and timings can be collected with a `FilterStats`.
+
+Data that does not fit in memory can be streamed with `iter_filter_data()`, e.g.
+over a file of newline-delimited JSON (JSONL) read with `iter_jsonl()`. The module
+can also be run as a script to filter JSONL from stdin to stdout:
+
+>>python json_data_struct_filter.py -f filters.json -m exclusive < in.jsonl > out.jsonl
+
+Raw JSON records can also be filtered with `iter_filter_jsonl()`, which only
+decodes the values of the top level keys of the filtered fields, and passes the
+raw records that survive through as is instead of re-encoding them (the script's
+--raw option).
+
+For a mostly static collection of data instances that is queried many times, an
+`IndexedDataset` maintains hash indexes (for "match" filters) and n-gram indexes
+(for "in" filters) on chosen fields, so queries only evaluate filters against
+candidate instances instead of scanning every instance.
 
 """
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import copy
+import json
 import operator
-from functools import reduce
+import os
+from functools import partial, reduce
 import re
+import sys
+from time import perf_counter_ns
+
+
+FILTER_TYPES = ("match", "in", "re-match", "re-search", "replace")
+MODES = ("inclusive", "exclusive")
+COPY_MODES = ("none", "returned", "full")
+
+# Inputs smaller than this are always filtered serially, as the cost of pickling
+# chunks to and from worker processes outweighs the parallel speedup
+PARALLEL_MIN_INSTANCES = 10000
+PARALLEL_MIN_CHUNKSIZE = 1000
+
+# Estimated relative cost of evaluating each filter type, used (with the observed
+# selectivity of each filter) to order the filters so that cheap, selective
+# filters are evaluated first
+FILTER_COSTS = {"match": 1, "in": 2, "re-match": 4, "re-search": 8}
+# Sibling filters are re-ordered by cost and observed selectivity every this many evaluations
+REORDER_INTERVAL = 1024
+# The pure python Aho-Corasick automaton steps through a string a character at a
+# time, so it is only faster than separate (C level) substring checks for many substrings
+AHO_CORASICK_MIN_LITERALS = 64
+# A combined regex alternation is much faster than separate regexes for some patterns
+# (e.g. starting with \b) and much slower for others (e.g. literals), so both are timed
+# on alternate evaluations of a field for this many evaluations and the faster is kept
+FUSION_TRIALS = 64
+# Decoding only the filtered keys of raw records (see `FilterPlan.matches_raw()`) is much
+# faster than decoding them in full for large records, and slower for small ones, so both
+# are timed on alternate records for this many records and the faster is kept
+RAW_DECODE_TRIALS = 256
+
+_LIST_INDEX_RE = re.compile(r"\[[0-9]+\]")
+# backreferences (by number or name), conditional groups and global inline flags
+# (e.g. "(?i)", which before python 3.11 apply to the whole combined alternation
+# from anywhere in it) change meaning when a pattern is nested in a combined
+# alternation, so such patterns are not fused
+_UNFUSABLE_RE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)")
+
+# JSON strings (with escapes), and JSON whitespace
+_JSON_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+_JSON_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+_MISSING = object()  # sentinel for a field path not present in an instance
 
 
 def get_by_path(root, items):
@@ -37,12 +110,18 @@ def set_by_path(root, items, value):
     get_by_path(root, items[:-1])[items[-1]] = value
 
 
-def filter_data(data, filters, mode="inclusive", compound=True):
+def filter_data(data, filters, mode="inclusive", compound=True, copy="returned", workers=None, executor=None,
+                stats=None):
     """Filter in or out data instances based on supplied filters
 
     Can handle fields in nested dict/list(s), at any level
 
-    Deepcopies data so that the data returned is entirely independent set
+    By default the supplied data is never modified and only the instances that
+    are returned are copied (see the 'copy' arg).
+
+    This is a convenience wrapper that compiles the filters and applies them
+    once. When the same filters are applied repeatedly, compile them once with
+    `compile_filters()` and reuse the returned `FilterPlan`.
 
     Filter format:
 
@@ -70,7 +149,31 @@ def filter_data(data, filters, mode="inclusive", compound=True):
     within the python regex pattern string spec
 
     <replace> is the value to replace the actual <value> that was matched, if the
-    filter type is "replace"
+    filter type is "replace". The text matched by the <value> regex pattern (or, if the
+    pattern has groups, by its first group) is replaced. The 'replace' filters on a
+    field are applied one after another in the order given, each to the result of the
+    filters before it.
+
+    Filters (other than 'replace' filters) may also be combined into nested boolean
+    expressions, where the value of "and"/"or" is a list of filters and/or expressions
+    and the value of "not" is a single filter or expression:
+
+    expression_1 = {
+        "or": [
+            {"and": [filter_1, filter_2]},
+            {"not": filter_3}
+        ]
+    }
+
+    The filters and expressions in the supplied list of filters are combined with
+    "and" (compound) or "or" (not compound). Filters are not necessarily evaluated
+    in the order given: cheaper filters, and filters observed to decide the outcome
+    more often, are evaluated first, and evaluation stops as soon as the outcome is
+    known.
+
+    A filter does not match an instance without its field: a missing key, a list
+    index past the end of the list, or a path through a value that is not a
+    dict/list (e.g. a string). 'replace' filters skip such instances.
 
     Args:
         data (list): list of JSON-like data structures. Each item in the list
@@ -85,95 +188,1361 @@ def filter_data(data, filters, mode="inclusive", compound=True):
         compound (bool): flag to specify whether the filters should be applied
           together (as one compound filter) or separately. If one of the filters
           is of type 'replace', then this flag is ignored.
+        copy (str): how data instances are copied. "returned" (default) deepcopies
+          only the instances that are returned, and for 'replace' filters copies
+          only the dicts/lists along the modified field paths, so modified instances
+          share untouched subtrees with the supplied data (and unmodified instances
+          are returned as is). "full" deepcopies all data so that the data returned
+          is an entirely independent set. "none" copies nothing, so 'replace' filters
+          modify the supplied data in place.
+        workers (int): number of worker processes to split the data across (see
+          `FilterPlan.__call__()`). Default is to filter in this process.
+        executor (concurrent.futures.Executor): executor to split the data across
+          instead of creating a process pool (see `FilterPlan.__call__()`)
+        stats (FilterStats): collect per filter counters into this (see `FilterStats`)
 
     Returns: (list) data instances that matched filter(s)
     """
-    results = []
-    data = copy.deepcopy(data)  # modify locally
-    filters = copy.deepcopy(filters)  # modify locally
+    plan = compile_filters(filters, mode=mode, compound=compound, copy=copy, stats=stats)
+    return plan(data, workers=workers, executor=executor)
 
-    if not isinstance(data, list):
-        data = [data]  # make list so can iterate regardless
 
-    if not isinstance(filters, list):
-        filters = [filters]
+def iter_filter_data(iterable, filters, mode="inclusive", compound=True, copy="returned", stats=None):
+    """Lazily filter in or out data instances based on supplied filters
 
-    # expand nested field paths to a list (to work with access functions)
-    for filt in filters:
-        filt["field"] = filt["field"].split(".")
+    Streaming equivalent of `filter_data()`: instances are consumed from any
+    iterable one at a time and matching (or replaced) instances are yielded as
+    they are found, so memory use does not grow with the size of the input.
 
-    # Any field path that has the "[#]" for are interpreted as list
-    # indexes (instead of keys), so convert them to integers so nested
-    # access works correctly
-    for filt in filters:
-        for idx, path_component in enumerate(filt["field"]):
-            if re.match("\[[0-9]+\]", path_component):
-                filt["field"][idx] = int(path_component.strip("[]"))
-
-    for instance in data:
-        match_count = 0
-        replace_flag = False
-        match = False
-
-        for filt in filters:
-            if not in_nested_path(instance, filt["field"]):
-                continue
-
-            if filt["type"] == "match":
-                if get_by_path(instance, filt["field"]) == filt["value"]:
-                    match_count += 1
-                    if not compound:
-                        break
-            elif filt["type"] == "in":
-                if filt["value"] in get_by_path(instance, filt["field"]):
-                    match_count += 1
-                    if not compound:
-                        break
-            elif filt["type"] == "re-match":
-                if re.match(filt["value"], get_by_path(instance, filt["field"])):
-                    match_count += 1
-                    if not compound:
-                        break
-            elif filt["type"] == "re-search":
-                if re.search(filt["value"], get_by_path(instance, filt["field"])):
-                    match_count += 1
-                    if not compound:
-                        break
-            elif filt["type"] == "replace":
-                replace_flag = True
-                instance_value = get_by_path(instance, filt["field"])
-                matches = re.findall(filt["value"], instance_value)
-                if matches:
-                    for match in matches:
-                        if type(match) is tuple:
-                            # multi group regular expression, just going to use first one
-                            match = match[0]
-                        instance_value = instance_value.replace(match, filt["replace"])
-                    set_by_path(instance, filt["field"], instance_value)
-                    match_count += 1
-
-        if replace_flag:
-            # if one of the filters was of type==replace, 'compound' and
+    Usage:
+
+    >>> with open("records.jsonl") as fh:
+    ...     for instance in iter_filter_data(iter_jsonl(fh), filters):
+    ...         print(instance)
+
+    Args:
+        iterable (iterable): iterable of JSON-like data structures
+        filters (list): list of filters (see `filter_data()` for filter format)
+        mode (str): "inclusive" or "exclusive" (see `filter_data()`)
+        compound (bool): whether filters are applied as one compound filter
+          (see `filter_data()`)
+        copy (str): "none", "returned" or "full" (see `filter_data()`)
+        stats (FilterStats): collect per filter counters into this (see `FilterStats`)
+
+    Returns: (generator) data instances that matched filter(s)
+    """
+    plan = compile_filters(filters, mode=mode, compound=compound, copy=copy, stats=stats)
+    return plan.iter(iterable)
+
+
+def iter_jsonl(fh):
+    """Lazily decode a newline-delimited JSON (JSONL) file
+
+    Blank lines are skipped.
+
+    Args:
+        fh (file): file object (or any iterable of lines) of JSONL
+
+    Returns: (generator) decoded JSON-like data instances
+    """
+    for line in fh:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_filter_jsonl(lines, filters, mode="inclusive", compound=True):
+    """Lazily filter in or out raw JSON records based on supplied filters
+
+    Only the filtered fields of each record are decoded, and the raw records that
+    survive are yielded as is (see `FilterPlan.iter_raw()`).
+
+    Usage:
+
+    >>> with open("records.jsonl", "rb") as fh:
+    ...     for line in iter_filter_jsonl(fh, filters):
+    ...         sys.stdout.buffer.write(line + b"\\n")
+
+    Args:
+        lines (iterable): iterable of raw JSON records (str or bytes), e.g. a
+          JSONL file object
+        filters (list): list of filters (see `filter_data()` for filter format)
+        mode (str): "inclusive" or "exclusive" (see `filter_data()`)
+        compound (bool): whether filters are applied as one compound filter
+          (see `filter_data()`)
+
+    Returns: (generator) raw JSON records that matched filter(s)
+    """
+    return compile_filters(filters, mode=mode, compound=compound).iter_raw(lines)
+
+
+def compile_filters(filters, mode="inclusive", compound=True, copy="returned", stats=None):
+    """Compile filters into a reusable `FilterPlan`
+
+    Field paths are parsed and regex patterns are compiled once, here, instead
+    of on every call to `filter_data()`.
+
+    Usage:
+
+    >>> plan = compile_filters([{"type": "in", "field": "a.[0].b", "value": "mule"}])
+    >>> plan([{"a": [{"b": "the mule"}]}, {"a": [{"b": "hari"}]}])
+    [{'a': [{'b': 'the mule'}]}]
+    >>> plan.matches({"a": [{"b": "hari"}]})
+    False
+
+    Args:
+        filters (list): list of filters (see `filter_data()` for filter format)
+        mode (str): "inclusive" or "exclusive" (see `filter_data()`)
+        compound (bool): whether filters are applied as one compound filter
+          (see `filter_data()`)
+        copy (str): "none", "returned" or "full" (see `filter_data()`)
+        stats (FilterStats): collect per filter counters into this (see `FilterStats`)
+
+    Returns: (FilterPlan) compiled filters
+    """
+    return FilterPlan(filters, mode=mode, compound=compound, copy=copy, stats=stats)
+
+
+class FilterPlan:
+    """A compiled set of filters
+
+    Calling the plan on a list of data instances is equivalent to calling
+    `filter_data()` with the filters, mode, compound flag and copy mode the
+    plan was compiled with.
+    """
+
+    def __init__(self, filters, mode="inclusive", compound=True, copy="returned", stats=None):
+        if not isinstance(filters, list):
+            filters = [filters]
+        if mode not in MODES:
+            raise ValueError(f"Filter mode '{mode}' not found")
+        if copy not in COPY_MODES:
+            raise ValueError(f"Copy mode '{copy}' not found")
+
+        self.filters = filters
+        self.mode = mode
+        self.compound = compound
+        self.copy = copy
+        self.stats = stats
+
+        self._replacers = [
+            _CompiledFilter(filt) for filt in filters if filt.get("type") == "replace"
+        ]
+        self._substitutions = [0] * len(self._replacers)
+        self._transforms = _transform_trie(self._replacers, self._substitutions, stats=stats)
+        self._root = _build_node(
+            [filt for filt in filters if filt.get("type") != "replace"], conjunction=compound, stats=stats
+        )
+        self._matches = self._root.evaluate
+        raw_keys = _raw_keys(_node_paths(self._root))
+        self._raw_decoder = None if raw_keys is None else _FasterOf(
+            partial(_decode_raw_keys, regex=raw_keys[0], escapes=raw_keys[1]), json.loads, trials=RAW_DECODE_TRIALS
+        )
+
+    def __reduce__(self):
+        # compiled regexes and tests are rebuilt on unpickling (e.g. in worker processes),
+        # without stats, which can not be collected from other processes
+        return (FilterPlan, (self.filters, self.mode, self.compound, self.copy))
+
+    def __call__(self, data, workers=None, executor=None, chunksize=None):
+        """Apply the plan to data
+
+        The data may be split into chunks that are filtered in parallel, either
+        in a process pool of 'workers' processes (the filters are shipped to each
+        worker once) or by a supplied 'executor'. Results are returned in the
+        original order. Inputs of fewer than PARALLEL_MIN_INSTANCES instances are
+        always filtered serially.
+
+        Instances filtered in other processes are always returned as independent
+        copies, so with copy="none" 'replace' filters do not modify the supplied data,
+        and their filter stats are not collected.
+
+        Args:
+            data (list): list of JSON-like data structures
+            workers (int): number of worker processes to create. Ignored if an
+              executor is supplied.
+            executor (concurrent.futures.Executor): executor to map chunks over,
+              e.g. a long lived ProcessPoolExecutor shared between calls
+            chunksize (int): number of instances per chunk. Default is to create
+              about 4 chunks per worker.
+
+        Returns: (list) data instances that matched filter(s), or all data
+          instances (possibly modified) if the plan has 'replace' filters
+        """
+        if not isinstance(data, list):
+            data = [data]  # make list so can iterate regardless
+
+        parallel = executor is not None or (workers is not None and workers > 1)
+        if not parallel or len(data) < PARALLEL_MIN_INSTANCES:
+            return list(self.iter(data))
+
+        if chunksize is None:
+            n_chunks = 4 * (workers or os.cpu_count() or 1)
+            chunksize = max(PARALLEL_MIN_CHUNKSIZE, -(-len(data) // n_chunks))
+        chunks = [data[idx:idx + chunksize] for idx in range(0, len(data), chunksize)]
+
+        if executor is None:
+            # results are pickled back from the workers, so they need no copying there
+            initargs = (self.filters, self.mode, self.compound, "none")
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+                results = pool.map(_filter_chunk, chunks)
+                return [instance for chunk in results for instance in chunk]
+
+        plan = self
+        if isinstance(executor, ProcessPoolExecutor):
+            plan = FilterPlan(self.filters, mode=self.mode, compound=self.compound, copy="none")
+        results = executor.map(partial(_apply_plan, plan), chunks)
+        return [instance for chunk in results for instance in chunk]
+
+    def iter(self, iterable):
+        """Lazily apply the plan to an iterable of data instances
+
+        Instances are copied one at a time as they are consumed, according to
+        the plan's copy mode.
+
+        Args:
+            iterable (iterable): iterable of JSON-like data structures
+
+        Returns: (generator) data instances that matched filter(s), or all data
+          instances (possibly modified) if the plan has 'replace' filters
+        """
+        if self._replacers:
+            # if one of the filters is of type==replace, 'compound' and
             # 'exclusive/inclusive' options are ignored as can no longer apply.
             # All data instances are returned no matter what (albeit some possibly modified)
-            results.append(instance)
+            if self.copy == "full":
+                for instance in iterable:
+                    yield self._replace(copy.deepcopy(instance), in_place=True)
+            else:
+                in_place = self.copy == "none"
+                for instance in iterable:
+                    yield self._replace(instance, in_place=in_place)
+            return
+
+        matches = self._matches
+        keep = self.mode == "inclusive"
+        if self.copy == "returned":
+            # only pay for copying the instances that survive
+            for instance in iterable:
+                if matches(instance) is keep:
+                    yield copy.deepcopy(instance)
+        elif self.copy == "full":
+            for instance in iterable:
+                instance = copy.deepcopy(instance)
+                if matches(instance) is keep:
+                    yield instance
+        else:
+            for instance in iterable:
+                if matches(instance) is keep:
+                    yield instance
+
+    def iter_raw(self, lines):
+        """Lazily apply the plan to raw JSON records
+
+        Whether each record matches is decided by `matches_raw()`. Records that
+        survive are yielded raw, exactly as supplied but without surrounding
+        whitespace, so they are never re-encoded. Plans with 'replace' filters
+        yield the re-encoded result.
+
+        Args:
+            lines (iterable): iterable of raw JSON records (str or bytes), e.g.
+              a JSONL file object. Blank lines are skipped.
+
+        Returns: (generator) raw JSON records (of the same type as supplied)
+          that matched filter(s)
+        """
+        if self._replacers:
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.dumps(self._replace(json.loads(line), in_place=True))
+                yield record.encode() if isinstance(line, bytes) else record
+            return
+
+        matches_raw = self.matches_raw
+        keep = self.mode == "inclusive"
+        for line in lines:
+            line = line.strip()
+            if line and matches_raw(line) is keep:
+                yield line
+
+    def matches_raw(self, raw):
+        """Whether a single raw JSON record matches the plan's filter(s)
+
+        Only the values of the top level keys of the filtered fields are decoded
+        (see `_decode_raw_keys()`), so a record without any of them is not decoded
+        at all. Everything else is skipped without being decoded (or validated).
+        As with `json.loads()`, the last of duplicate keys is used. Records that
+        are not JSON objects, or that have escapes that could encode a key
+        differently (e.g. "\\u0061" for "a"), are decoded in full, and so are all
+        records if that is measured to be faster (see RAW_DECODE_TRIALS).
+
+        Args:
+            raw (str or bytes): JSON document
+
+        Returns: (bool) True if the record matches (see `matches()`)
+        """
+        if self._raw_decoder is None:
+            return self._matches(json.loads(raw))
+        if isinstance(raw, bytes):
+            raw = raw.decode()
+        return self._matches(self._raw_decoder.test(raw))
+
+    def matches(self, instance):
+        """Whether a single data instance matches the plan's filter(s)
+
+        The plan's mode is not applied and 'replace' filters are not evaluated.
+
+        Args:
+            instance (obj): JSON-like data structure
+
+        Returns: (bool) True if the instance matches all filters (compound) or
+          any filter (not compound)
+        """
+        return self._matches(instance)
+
+    def substitution_counts(self):
+        """Number of substitutions made by each 'replace' filter so far
+
+        Returns: (list) count for each 'replace' filter, in the order given
+        """
+        return list(self._substitutions)
+
+    def _replace(self, instance, in_place):
+        """Apply 'replace' filters to an instance
+
+        All fields are transformed in a single traversal of the instance. If not
+        in_place, the instance is left untouched and a copy is returned in which
+        only the dicts/lists along the modified field paths are copied.
+        """
+        return _apply_transforms(instance, self._transforms, in_place, count_misses=self.stats is not None)
+
+
+class FilterStats:
+    """Per filter counters, collected by plans compiled with 'stats'
+
+    Usage:
+
+    >>> stats = FilterStats()
+    >>> results = filter_data(data, filters, stats=stats)
+    >>> for row in stats.report():
+    ...     print(row["filter"], row["hit_rate"], row["seconds"])
+
+    For each filter, counts how often it was evaluated, how often it matched
+    (or, for 'replace' filters, made a substitution), how often the field was
+    missing from the instance and the total time spent evaluating it. Filters
+    that are skipped because the outcome is already known (see `filter_data()`)
+    are not counted. A stats object may be shared by many plans.
+
+    Collecting stats evaluates (and times) every filter on its own, instead of
+    fused with the other filters on the same field, so it slows filtering down,
+    but never changes what filtering returns: each filter test has the same
+    outcome as the fused test, and 'replace' filters are substituted exactly as
+    without stats. Stats are not collected by other processes.
+    """
+
+    def __init__(self):
+        self._counters = []
+
+    def _counter(self, filt):
+        counter = _FilterCounter(filt)
+        self._counters.append(counter)
+        return counter
+
+    def report(self):
+        """Counters of every filter
+
+        Returns: (list) dict for each filter with keys "filter", "evaluations",
+          "hits", "hit_rate", "path_misses" and "seconds"
+        """
+        return [
+            {
+                "filter": counter.filter,
+                "evaluations": counter.evaluations,
+                "hits": counter.hits,
+                "hit_rate": counter.hits / counter.evaluations if counter.evaluations else 0.0,
+                "path_misses": counter.path_misses,
+                "seconds": counter.time_ns / 1e9,
+            }
+            for counter in self._counters
+        ]
+
+    def reset(self):
+        """Zero all counters"""
+        for counter in self._counters:
+            counter.evaluations = counter.hits = counter.path_misses = counter.time_ns = 0
+
+
+class IndexedDataset:
+    """A collection of data instances with secondary indexes on field paths
+
+    "match" filters on fields in 'match_fields' are answered from a hash index
+    of field value to instances, and "in" filters with string values on fields
+    in 'in_fields' from an n-gram index of field value substrings to instances.
+    A query intersects (compound) or unions (not compound) the candidate
+    instances of its indexed filters and only evaluates the filters against
+    those candidates. Filters on unindexed fields are still supported, but
+    fall back to evaluating against every instance as needed.
+
+    Instances are assigned integer ids in insertion order, which is also the
+    order query results are returned in. Instances must not be modified in
+    place once added, use `update()` instead so the indexes stay consistent.
+
+    Usage:
+
+    >>> ds = IndexedDataset(data, match_fields=["planet.name"], in_fields=["name"])
+    >>> ds.query([{"type": "in", "field": "name", "value": "mule"}])
+    [{'name': 'the mule', 'planet': {'name': 'kalgan'}}]
+    >>> idx = ds.insert({"name": "bayta", "planet": {"name": "haven"}})
+    >>> ds.delete(idx)
+    """
+
+    def __init__(self, data=None, match_fields=(), in_fields=(), ngram=3):
+        """
+        Args:
+            data (list): initial JSON-like data instances
+            match_fields (list): fields (in filter field format) to hash index
+            in_fields (list): fields (in filter field format) to n-gram index
+            ngram (int): length of substrings in the n-gram indexes. "in" filters
+              with values shorter than this can not use the index.
+        """
+        self._instances = {}
+        self._next_id = 0
+        self._indexes = {}
+        for field in match_fields:
+            self._indexes[("match", _parse_field(field))] = _HashIndex(_parse_field(field))
+        for field in in_fields:
+            self._indexes[("in", _parse_field(field))] = _NgramIndex(_parse_field(field), ngram)
+
+        for instance in data or []:
+            self.insert(instance)
+
+    def __len__(self):
+        return len(self._instances)
+
+    def __iter__(self):
+        return iter(self._instances.values())
+
+    def __contains__(self, idx):
+        return idx in self._instances
+
+    def __getitem__(self, idx):
+        return self._instances[idx]
+
+    def insert(self, instance):
+        """Add a data instance
+
+        Returns: (int) id of the instance
+        """
+        idx = self._next_id
+        self._next_id += 1
+        self._instances[idx] = instance
+        for index in self._indexes.values():
+            index.add(idx, instance)
+        return idx
+
+    def update(self, idx, instance):
+        """Replace the data instance with id 'idx'"""
+        old = self._instances[idx]
+        for index in self._indexes.values():
+            index.remove(idx, old)
+            index.add(idx, instance)
+        self._instances[idx] = instance
+
+    def delete(self, idx):
+        """Remove the data instance with id 'idx'"""
+        instance = self._instances.pop(idx)
+        for index in self._indexes.values():
+            index.remove(idx, instance)
+
+    def query(self, filters, mode="inclusive", compound=True, copy="returned"):
+        """Filter in or out data instances based on supplied filters
+
+        Equivalent to `filter_data(list(dataset), filters, ...)`. Plans with
+        'replace' filters can not use the indexes and are applied to every
+        instance.
+
+        Args:
+            filters (list or FilterPlan): list of filters (see `filter_data()` for
+              filter format) or an already compiled plan
+            mode (str): "inclusive" or "exclusive" (see `filter_data()`)
+            compound (bool): whether filters are applied as one compound filter
+              (see `filter_data()`)
+            copy (str): "none", "returned" or "full" (see `filter_data()`). Ignored
+              if an already compiled plan is supplied.
+
+        Returns: (list) data instances that matched filter(s)
+        """
+        plan = filters
+        if not isinstance(plan, FilterPlan):
+            plan = compile_filters(filters, mode=mode, compound=compound, copy=copy)
+        if plan._replacers:
+            return plan(list(self._instances.values()))
+
+        matched = self.query_ids(plan)
+        if plan.mode == "exclusive":
+            matched = set(matched)
+            matched = [idx for idx in self._instances if idx not in matched]
+
+        results = [self._instances[idx] for idx in matched]
+        if plan.copy != "none":
+            results = _deepcopy_instances(results)
+        return results
+
+    def query_ids(self, plan):
+        """Ids of data instances that match the plan's filter(s)
+
+        The plan's mode is not applied.
+
+        Args:
+            plan (FilterPlan): compiled filters
+
+        Returns: (list) ids of matching instances, in insertion order
+        """
+        candidates = self._candidates(plan._root)
+        if candidates is None:
+            candidates = self._instances
+        else:
+            candidates = sorted(candidates)
+
+        instances = self._instances
+        matches = plan._matches
+        return [idx for idx in candidates if matches(instances[idx])]
+
+    def _candidates(self, node):
+        """Set of ids that may match the node, or None if every instance may"""
+        if isinstance(node, _FieldNode):
+            candidate_sets = []
+            for filt in node.filters:
+                index = self._indexes.get((filt.type, filt.path))
+                candidate_sets.append(index.candidates(filt.value) if index else None)
+            conjunction = node.conjunction
+        elif isinstance(node, (_AndNode, _OrNode)):
+            candidate_sets = [self._candidates(child) for child in node.children]
+            conjunction = isinstance(node, _AndNode)
+        else:
+            return None  # _NotNode
+
+        if conjunction:
+            candidate_sets = [ids for ids in candidate_sets if ids is not None]
+            if not candidate_sets:
+                return None
+            candidate_sets.sort(key=len)
+            return candidate_sets[0].intersection(*candidate_sets[1:])
+
+        if None in candidate_sets:
+            return None
+        return set().union(*candidate_sets)
+
+
+# -- Internal --
+
+
+_WORKER_PLAN = None  # plan compiled once per worker process by _init_worker()
+
+
+def _init_worker(filters, mode, compound, copy):
+    """Process pool initializer that compiles the plan for the worker"""
+    global _WORKER_PLAN
+    _WORKER_PLAN = FilterPlan(filters, mode=mode, compound=compound, copy=copy)
+
+
+def _filter_chunk(chunk):
+    """Filter a chunk of data with the worker's plan"""
+    return list(_WORKER_PLAN.iter(chunk))
+
+
+def _apply_plan(plan, chunk):
+    """Filter a chunk of data with a (shipped) plan"""
+    return list(plan.iter(chunk))
+
+
+class _FilterCounter:
+    """Counters of a single filter (see `FilterStats`)"""
+
+    __slots__ = ("filter", "evaluations", "hits", "path_misses", "time_ns")
+
+    def __init__(self, filt):
+        self.filter = filt
+        self.evaluations = 0
+        self.hits = 0
+        self.path_misses = 0
+        self.time_ns = 0
+
+
+class _CompiledFilter:
+    """A single filter with a parsed field path and a specialized test"""
+
+    def __init__(self, filt):
+        self.spec = filt
+        self.type = filt["type"]
+        self.field = filt["field"]
+        self.value = filt["value"]
+        self.replace = filt.get("replace")
+        self.path = _parse_field(self.field)
+        self.regex = None
+
+        value = self.value
+        if self.type == "match":
+            self.test = lambda instance_value: instance_value == value
+        elif self.type == "in":
+            self.test = lambda instance_value: value in instance_value
+        elif self.type == "re-match":
+            self.regex = re.compile(value)
+            self.test = self.regex.match
+        elif self.type == "re-search":
+            self.regex = re.compile(value)
+            self.test = self.regex.search
+        elif self.type == "replace":
+            self.regex = re.compile(value)
+            self.test = self.regex.search
+        else:
+            raise ValueError(f"Filter type '{self.type}' not found")
+
+
+class _HashIndex:
+    """Index of the (hashable) values at a field path to instance ids"""
+
+    def __init__(self, path):
+        self.path = path
+        self.postings = {}
+        self.unhashable = set()  # ids with a value that can not be indexed
+
+    def add(self, idx, instance):
+        value = _resolve(instance, self.path)
+        if value is _MISSING:
+            return
+        try:
+            self.postings.setdefault(value, set()).add(idx)
+        except TypeError:
+            self.unhashable.add(idx)
+
+    def remove(self, idx, instance):
+        value = _resolve(instance, self.path)
+        if value is _MISSING:
+            return
+        try:
+            ids = self.postings.get(value)
+        except TypeError:
+            self.unhashable.discard(idx)
+            return
+        if ids is not None:
+            ids.discard(idx)
+            if not ids:
+                del self.postings[value]
+
+    def candidates(self, value):
+        """Ids that may have a value equal to 'value', or None if unknown"""
+        try:
+            ids = self.postings.get(value, ())
+        except TypeError:
+            return None
+        return self.unhashable.union(ids)
+
+
+class _NgramIndex:
+    """Index of the substrings of length n of the string values at a field
+    path to instance ids"""
+
+    def __init__(self, path, n):
+        self.path = path
+        self.n = n
+        self.postings = {}
+        self.others = set()  # ids with a non-string value (e.g. lists, for "in")
+
+    def _ngrams(self, value):
+        n = self.n
+        return {value[idx:idx + n] for idx in range(len(value) - n + 1)}
+
+    def add(self, idx, instance):
+        value = _resolve(instance, self.path)
+        if value is _MISSING:
+            return
+        if not isinstance(value, str):
+            self.others.add(idx)
+            return
+        for gram in self._ngrams(value):
+            self.postings.setdefault(gram, set()).add(idx)
+
+    def remove(self, idx, instance):
+        value = _resolve(instance, self.path)
+        if value is _MISSING:
+            return
+        if not isinstance(value, str):
+            self.others.discard(idx)
+            return
+        for gram in self._ngrams(value):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(idx)
+                if not ids:
+                    del self.postings[gram]
+
+    def candidates(self, value):
+        """Ids that may have a value containing 'value', or None if unknown"""
+        if not isinstance(value, str) or len(value) < self.n:
+            return None
+        postings = []
+        for gram in self._ngrams(value):
+            ids = self.postings.get(gram)
+            if not ids:
+                return set(self.others)
+            postings.append(ids)
+        postings.sort(key=len)
+        return self.others.union(postings[0].intersection(*postings[1:]))
+
+
+def _build_node(filters, conjunction, stats=None):
+    """Compile a list of filters and expressions into a tree of nodes
+
+    Sibling filters on the same field are grouped into a single _FieldNode.
+
+    Args:
+        filters (list): filters and/or "and"/"or"/"not" expressions
+        conjunction (bool): whether the list is combined with "and" (else "or")
+        stats (FilterStats): if supplied, field nodes count every filter evaluation
+
+    Returns: (node) root node, with an 'evaluate(instance)' method
+    """
+    children = []
+    groups = {}
+    for filt in filters:
+        if "and" in filt or "or" in filt:
+            sub_filters = filt["and"] if "and" in filt else filt["or"]
+            if not isinstance(sub_filters, list):
+                sub_filters = [sub_filters]
+            children.append(_build_node(sub_filters, conjunction="and" in filt, stats=stats))
+        elif "not" in filt:
+            children.append(_NotNode(_build_node([filt["not"]], conjunction=True, stats=stats)))
+        else:
+            compiled = _CompiledFilter(filt)
+            if compiled.type == "replace":
+                raise ValueError("'replace' filters can not be combined in expressions")
+            groups.setdefault(compiled.path, []).append(compiled)
+
+    # group filters by field so each field path is resolved once per instance
+    # and all of the field's filters are evaluated in as few passes as possible
+    for group in groups.values():
+        if stats is None:
+            children.append(_FieldNode(group, conjunction))
+        else:
+            children.append(_CountingFieldNode(group, conjunction, stats))
+
+    if len(children) == 1:
+        return children[0]
+    if conjunction:
+        return _AndNode(children)
+    return _OrNode(children)
+
+
+class _FieldNode:
+    """Leaf node for all sibling filters on one field"""
+
+    def __init__(self, filters, conjunction):
+        self.filters = filters
+        self.conjunction = conjunction
+        self.path = filters[0].path
+        self.test, self.cost = _field_test(filters, conjunction)
+        self.cost += len(self.path)
+        self.evaluations = 0
+        self.passes = 0
+
+    def evaluate(self, instance):
+        self.evaluations += 1
+        try:
+            for item in self.path:
+                instance = instance[item]
+        except (KeyError, IndexError, TypeError):
+            return False
+        if self.test(instance):
+            self.passes += 1
+            return True
+        return False
+
+
+class _CountingFieldNode(_FieldNode):
+    """Field node that evaluates its filters one at a time and counts (and times)
+    every evaluation (see `FilterStats`)"""
+
+    def __init__(self, filters, conjunction, stats):
+        # the fused test of the filters is not needed, only its cost
+        self.filters = filters
+        self.conjunction = conjunction
+        self.path = filters[0].path
+        self.cost = sum(FILTER_COSTS[filt.type] for filt in filters) + len(self.path)
+        self.evaluations = 0
+        self.passes = 0
+        self.counters = [stats._counter(filt.spec) for filt in filters]
+        self.test = self._counting_test
+
+    def evaluate(self, instance):
+        self.evaluations += 1
+        try:
+            for item in self.path:
+                instance = instance[item]
+        except (KeyError, IndexError, TypeError):
+            for counter in self.counters:
+                counter.path_misses += 1
+            return False
+        if self.test(instance):
+            self.passes += 1
+            return True
+        return False
+
+    def _counting_test(self, value):
+        conjunction = self.conjunction
+        for filt, counter in zip(self.filters, self.counters):
+            start = perf_counter_ns()
+            hit = filt.test(value)
+            counter.time_ns += perf_counter_ns() - start
+            counter.evaluations += 1
+            if hit:
+                counter.hits += 1
+                if not conjunction:
+                    return True
+            elif conjunction:
+                return False
+        return conjunction
+
+
+class _AndNode:
+    """Node that matches if all its children match
+
+    Children are evaluated in increasing order of cost per rejection, so the
+    evaluation most likely to stop early, cheaply, comes first.
+    """
+
+    def __init__(self, children):
+        self.children = sorted(children, key=lambda child: child.cost)
+        self.cost = sum(child.cost for child in children)
+        self.evaluations = 0
+        self.passes = 0
+
+    def evaluate(self, instance):
+        self.evaluations += 1
+        if not self.evaluations % REORDER_INTERVAL:
+            self.children = sorted(
+                self.children, key=lambda child: child.cost / (1 - _pass_rate(child))
+            )
+        for child in self.children:
+            if not child.evaluate(instance):
+                return False
+        self.passes += 1
+        return True
+
+
+class _OrNode:
+    """Node that matches if any of its children match
+
+    Children are evaluated in increasing order of cost per acceptance, so the
+    evaluation most likely to stop early, cheaply, comes first.
+    """
+
+    def __init__(self, children):
+        self.children = sorted(children, key=lambda child: child.cost)
+        self.cost = sum(child.cost for child in children)
+        self.evaluations = 0
+        self.passes = 0
+
+    def evaluate(self, instance):
+        self.evaluations += 1
+        if not self.evaluations % REORDER_INTERVAL:
+            self.children = sorted(
+                self.children, key=lambda child: child.cost / _pass_rate(child)
+            )
+        for child in self.children:
+            if child.evaluate(instance):
+                self.passes += 1
+                return True
+        return False
+
+
+class _NotNode:
+    """Node that matches if its child does not"""
+
+    def __init__(self, child):
+        self.child = child
+        self.cost = child.cost
+        self.evaluations = 0
+        self.passes = 0
+
+    def evaluate(self, instance):
+        self.evaluations += 1
+        if self.child.evaluate(instance):
+            return False
+        self.passes += 1
+        return True
+
+
+def _pass_rate(node):
+    """Observed rate at which a node matches (smoothed, so never 0 or 1)"""
+    return (node.passes + 1) / (node.evaluations + 2)
+
+
+def _transform_trie(replacers, counts, stats=None):
+    """Merge the field paths of 'replace' filters into a trie of _FieldTransform(s)
+
+    Each trie node is a dict of path component to a tuple of the _FieldTransform
+    for the path ending there (or None) and the child trie node.
+    """
+    rules = {}
+    for idx, filt in enumerate(replacers):
+        rules.setdefault(filt.path, []).append((idx, filt))
+
+    trie = {}
+    for path, field_rules in rules.items():
+        node = trie
+        for item in path[:-1]:
+            transform, children = node.setdefault(item, (None, {}))
+            node = children
+        _, children = node.get(path[-1], (None, {}))
+        node[path[-1]] = (_FieldTransform(field_rules, counts, stats=stats), children)
+    return trie
+
+
+def _apply_transforms(node, trie, in_place, count_misses=False):
+    """Apply the transforms in trie to node in one traversal
+
+    If count_misses, the path misses of transforms whose field is missing are
+    counted (see `FilterStats`).
+
+    Returns: (obj) node if nothing changed or in_place, otherwise a (shallow)
+      copy of node with the changes, sharing all unchanged children
+    """
+    result = node
+    for item, (transform, children) in trie.items():
+        try:
+            value = node[item]
+        except (KeyError, IndexError, TypeError):
+            if count_misses:
+                _count_transform_misses(transform, children)
+            continue
+        if transform is not None:
+            new_value = transform(value)
         else:
-            # Determine if match occured based on filters matched and whether
-            # the filters are specified as a compound filter
-            if compound:
-                if match_count == len(filters):
-                    match = True
-            elif not compound:
-                if match_count > 0:
-                    match = True
+            new_value = _apply_transforms(value, children, in_place, count_misses=count_misses)
+        if new_value is not value:
+            if result is node and not in_place:
+                result = copy.copy(node)
+            result[item] = new_value
+    return result
+
+
+def _count_transform_misses(transform, trie):
+    """Count a path miss for a transform and all transforms below it in trie"""
+    if transform is not None:
+        for counter in transform.counters.values():
+            counter.path_misses += 1
+    for child_transform, children in trie.values():
+        _count_transform_misses(child_transform, children)
+
+
+class _FieldTransform:
+    """All 'replace' filters on one field, applied to its value in the order given
+
+    Each filter is substituted by one `re.subn()`, with the (escaped) replacement
+    as the template if its pattern has no groups, so no python callback is called
+    per match. (Combining the patterns into one alternation, substituted in a
+    single pass, was slower and can not reproduce filters that apply to the result
+    of the filters before them.)
+    """
+
+    def __init__(self, rules, counts, stats=None):
+        """
+        Args:
+            rules (list): tuples of the index of the 'replace' filter and the filter
+            counts (list): substitution count of each 'replace' filter (updated in place)
+            stats (FilterStats): if supplied, count (and time) every filter evaluation
+        """
+        self.counts = counts
+        self.rules = rules
+        self.counters = {}
+        if stats is not None:
+            self.counters = {idx: stats._counter(filt.spec) for idx, filt in rules}
+        self._substitutions = []
+        for idx, filt in rules:
+            if filt.regex.groups:
+                repl = partial(self._substitute_group, idx, filt)
+            else:
+                repl = filt.replace.replace("\\", "\\\\")
+            self._substitutions.append((idx, filt.regex.subn, repl, not filt.regex.groups))
+
+    def __call__(self, value):
+        """Transformed value, or value itself if nothing was substituted"""
+        new_value = value
+        counts = self.counts
+        if not self.counters:
+            for idx, subn, repl, counted in self._substitutions:
+                new_value, substitutions = subn(repl, new_value)
+                if counted:
+                    counts[idx] += substitutions
+            return value if new_value == value else new_value
+
+        for idx, subn, repl, counted in self._substitutions:
+            counter = self.counters[idx]
+            before = counts[idx]
+            start = perf_counter_ns()
+            new_value, substitutions = subn(repl, new_value)
+            counter.time_ns += perf_counter_ns() - start
+            if counted:
+                counts[idx] += substitutions
+            counter.evaluations += 1
+            if counts[idx] > before:
+                counter.hits += 1
+        return value if new_value == value else new_value
+
+    def _substitute_group(self, idx, filt, match):
+        """Replacement text for a match of a filter whose pattern has groups"""
+        # multi group regular expression, just going to replace the first one
+        start, end = match.span(1)
+        if start == -1:
+            return match.group()  # first group did not participate in the match
+        self.counts[idx] += 1
+        offset = match.start()
+        text = match.group()
+        return text[:start - offset] + filt.replace + text[end - offset:]
+
+
+def _node_paths(node):
+    """All field paths a tree of nodes refers to"""
+    if isinstance(node, _FieldNode):
+        return [node.path]
+    if isinstance(node, _NotNode):
+        return _node_paths(node.child)
+    return [path for child in node.children for path in _node_paths(child)]
+
+
+def _raw_keys(paths):
+    """Regex of the top level keys of field paths in raw JSON records (see `FilterPlan.matches_raw()`)
+
+    Returns: (tuple) regex that matches an encoded key and the colon after it, and the
+      escape sequences that could encode a key differently, or None if a path starts
+      with a list index
+    """
+    keys = {path[0] for path in paths}
+    if not keys or not all(isinstance(key, str) for key in keys):
+        return None
+    encoded = [re.escape(json.dumps(key, ensure_ascii=False)) for key in sorted(keys)]
+    regex = re.compile(r"({})[ \t\n\r]*:".format("|".join(encoded)))
+    escapes = ("\\u", "\\/") if any("/" in key for key in keys) else ("\\u",)
+    return regex, escapes
+
+
+def _decode_raw_keys(raw, regex, escapes):
+    """Decode only the values of the top level keys that regex matches in a raw JSON object
+
+    Occurrences of the keys are found by regex and only the text before each
+    occurrence that has not been skipped yet is looked at: with its strings
+    removed (in C, by `str.split()` or `re.sub()`), its brackets tell the nesting
+    depth, and an unterminated string tells that the occurrence is in a string. The values of
+    the occurrences at the top level are decoded with `json.JSONDecoder.raw_decode()`,
+    and decoding continues after them.
+
+    Returns: (dict) the decoded keys and their values (of the last of duplicate
+      keys), or if raw is not a JSON object or has any of the escapes, all of raw
+      decoded
+    """
+    if not raw.startswith("{", _JSON_WHITESPACE_RE.match(raw).end()):
+        return json.loads(raw)
+    for escape in escapes:
+        if escape in raw:
+            return json.loads(raw)
+    instance = {}
+    # the text is looked at up to checkpoint, which is never in a string
+    checkpoint = objects = arrays = 0
+    match = regex.search(raw)
+    while match is not None:
+        start = match.start()
+        text = raw[checkpoint:start]
+        if "\\" in text:
+            text = _JSON_STRING_RE.sub("", text)
+            in_string = '"' in text
+        else:
+            # without escapes, strings are between every other pair of quotes
+            parts = text.split('"')
+            in_string = not len(parts) % 2
+            text = "".join(parts[::2])
+        if in_string:
+            match = regex.search(raw, start + 1)
+            continue
+        objects += text.count("{") - text.count("}")
+        arrays += text.count("[") - text.count("]")
+        checkpoint = start
+        if objects == 1 and not arrays:
+            instance[json.loads(match.group(1))], checkpoint = _DECODER.raw_decode(
+                raw, _JSON_WHITESPACE_RE.match(raw, match.end()).end()
+            )
+            match = regex.search(raw, checkpoint)
+        else:
+            match = regex.search(raw, match.end())
+    return instance
+
+
+def _field_test(filters, compound):
+    """Build a single test for all the (non 'replace') filters on one field
+
+    Returns: (tuple) callable of the field value that is True if all (compound) or
+      any (not compound) of the filters match it, and its estimated cost
+    """
+    if len(filters) == 1:
+        return filters[0].test, FILTER_COSTS[filters[0].type]
+
+    if compound:
+        # every filter must match, so neither the "in" filters nor the regexes can
+        # be matched together (a single pass only tells if any matched), but cheap
+        # tests go first and evaluation stops at the first test that fails
+        filters = sorted(filters, key=lambda filt: FILTER_COSTS[filt.type])
+        tests = [filt.test for filt in filters]
+        cost = sum(FILTER_COSTS[filt.type] for filt in filters)
+        return (lambda value: all(test(value) for test in tests)), cost
+
+    # many "in" filters with string values are matched together by an Aho-Corasick
+    # automaton when the field value is a string
+    literals = [filt for filt in filters if filt.type == "in" and isinstance(filt.value, str)]
+    if len(literals) >= AHO_CORASICK_MIN_LITERALS:
+        automaton = _AhoCorasick([filt.value for filt in literals])
+        literal_tests = [filt.test for filt in literals]
+        filters = [filt for filt in filters if filt not in literals]
+    else:
+        automaton = None
+
+    # not compound, so a single match of any filter is enough
+    regex_filters = [filt for filt in filters if filt.type in ("re-match", "re-search")]
+    regex = _fuse_regexes(regex_filters)
+    if regex is not None:
+        filters = [filt for filt in filters if filt not in regex_filters]
+        regex_tests = [filt.test for filt in regex_filters]
+        regex = _FasterOf(regex.search, lambda value: any(test(value) for test in regex_tests))
+    filters = sorted(filters, key=lambda filt: FILTER_COSTS[filt.type])
+    tests = [filt.test for filt in filters]
+    cost = sum(FILTER_COSTS[filt.type] for filt in filters)
+    if automaton is not None:
+        cost += 2 * FILTER_COSTS["in"]
+    if regex is not None:
+        cost += 2 * FILTER_COSTS["re-search"]
+
+    def test_any(value):
+        if any(test(value) for test in tests):
+            return True
+        if automaton is not None:
+            if isinstance(value, str):
+                if automaton.contains_any(value):
+                    return True
+            elif any(test(value) for test in literal_tests):
+                return True
+        return regex is not None and bool(regex.test(value))
+
+    return test_any, cost
+
+
+def _fuse_regexes(filters):
+    """Combine "re-match" and "re-search" filters into one regex alternation
+
+    Returns: (re.Pattern) combined regex, or None if there are too few filters
+      or they can not be combined
+    """
+    if len(filters) < 2:
+        return None
+    patterns = []
+    for filt in filters:
+        if not isinstance(filt.value, str) or _UNFUSABLE_RE.search(filt.value):
+            return None
+        # re.match() is re.search() anchored to the start of the string
+        anchor = "\\A" if filt.type == "re-match" else ""
+        patterns.append(f"{anchor}(?:{filt.value})")
+    try:
+        return re.compile("|".join(patterns))
+    except re.error:
+        # e.g. the same group name in more than one of the patterns
+        return None
+
+
+class _FasterOf:
+    """Two equivalent tests, of which the faster is used
+
+    For the first 'trials' calls of 'test()' the tests are called (and timed)
+    alternately, after which 'test' is replaced by the test that took less time.
+    """
+
+    def __init__(self, first, second, trials=FUSION_TRIALS):
+        self.tests = (first, second)
+        self.trials = trials
+        self.times = [0, 0]
+        self.calls = 0
+        self.test = self._trial
+
+    def _trial(self, value):
+        which = self.calls % 2
+        start = perf_counter_ns()
+        try:
+            return self.tests[which](value)
+        finally:
+            self.times[which] += perf_counter_ns() - start
+            self.calls += 1
+            if self.calls >= self.trials:
+                self.test = self.tests[0] if self.times[0] <= self.times[1] else self.tests[1]
+
+
+class _AhoCorasick:
+    """Aho-Corasick automaton for finding many substrings in one pass over a string
+
+    Transitions are completed lazily (following failure links once per state and
+    character and caching the result), so matching is a dict lookup per character.
+    """
+
+    def __init__(self, patterns):
+        goto = [{}]
+        outputs = [set()]
+        for idx, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                if char not in goto[state]:
+                    goto.append({})
+                    outputs.append(set())
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            outputs[state].add(idx)
+
+        # breadth first construction of failure links
+        fail = [0] * len(goto)
+        queue = [0]
+        for state in queue:
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                if state:
+                    fallback = fail[state]
+                    while fallback and char not in goto[fallback]:
+                        fallback = fail[fallback]
+                    fail[next_state] = goto[fallback].get(char, 0)
+                outputs[next_state] |= outputs[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = [frozenset(output) for output in outputs]
+        self._delta = [dict(transitions) for transitions in goto]
+
+    def _transition(self, state, char):
+        delta = self._delta[state]
+        goto = self._goto
+        next_state = state
+        while char not in goto[next_state]:
+            if next_state == 0:
+                delta[char] = 0
+                return 0
+            next_state = self._fail[next_state]
+        delta[char] = goto[next_state][char]
+        return delta[char]
+
+    def contains_any(self, text):
+        """Whether any of the patterns is a substring of text"""
+        outputs = self._outputs
+        if outputs[0]:
+            return True  # the empty string is in every string
+        delta = self._delta
+        state = 0
+        for char in text:
+            next_state = delta[state].get(char)
+            if next_state is None:
+                next_state = self._transition(state, char)
+            state = next_state
+            if outputs[state]:
+                return True
+        return False
+
+
+def _parse_field(field):
+    """Expand a nested field string to a path tuple (to work with access functions)
+
+    Any field path component of the form "[#]" is interpreted as a list
+    index (instead of a key), so it is converted to an integer so nested
+    access works correctly.
+    """
+    path = field.split(".")
+    for idx, path_component in enumerate(path):
+        if _LIST_INDEX_RE.match(path_component):
+            path[idx] = int(path_component.strip("[]"))
+    return tuple(path)
+
+
+def _deepcopy_instances(instances):
+    """Deepcopy a list of instances (for where the 'copy' arg shadows the module)"""
+    return copy.deepcopy(instances)
+
+
+def _resolve(instance, path):
+    """Get the value at path in instance, or _MISSING if path is not present
+
+    A list index past the end, or a path through a value that is not a dict or
+    list (e.g. a string), is missing too (see `filter_data()`).
+    """
+    try:
+        for item in path:
+            instance = instance[item]
+    except (KeyError, IndexError, TypeError):
+        return _MISSING
+    return instance
+
+
+def _get_argparser():
+    """to organize and clean format argparser args"""
+    parser = argparse.ArgumentParser(
+        description="Filter newline-delimited JSON (JSONL) from stdin to stdout"
+    )
+
+    parser.add_argument(
+        "-f",
+        "--filters",
+        action="store",
+        dest="filters",
+        required=True,
+        help="JSON file with the list of filters to apply"
+    )
+
+    parser.add_argument(
+        "-m",
+        "--mode",
+        action="store",
+        dest="mode",
+        choices=MODES,
+        default="inclusive",
+        help="filter mode"
+    )
+
+    parser.add_argument(
+        "--not-compound",
+        action="store_false",
+        dest="compound",
+        help="apply filters separately instead of as one compound filter"
+    )
+
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        dest="raw",
+        help="only decode the filtered fields of each record, and output surviving records as is"
+    )
+    return parser
+
+
+def main():
+    parser = _get_argparser()
+
+    # parse all args and put in dict
+    args = vars(parser.parse_args())
+
+    with open(args["filters"], 'r') as fh:
+        filters = json.load(fh)
 
-            if match and mode == "inclusive":
-                # inclusive filter mode and a match, so add
-                results.append(instance)
-            elif not match and mode == "exclusive":
-                # exclusive filter mode and not a match, so add
-                results.append(instance)
+    # each record is decoded from stdin and held by nothing else, so nothing needs copying
+    plan = compile_filters(filters, mode=args["mode"], compound=args["compound"], copy="none")
+    if args["raw"]:
+        for line in plan.iter_raw(sys.stdin.buffer):
+            sys.stdout.buffer.write(line + b"\n")
+        return
 
-    return results
+    for instance in plan.iter(iter_jsonl(sys.stdin)):
+        sys.stdout.write(json.dumps(instance) + "\n")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+--- Purpose
+Benchmark `json_data_struct_filter` on a reproducible synthetic dataset, to
+compare filter performance between changes.
+
+Covers every filter type on top level and nested fields, compound and
+non-compound, inclusive and exclusive, and filter lists of increasing size.
+Results are written as JSON so a later run can be compared against them.
+
+--- Usage
+>>python json_data_struct_filter_bench.py -n 20000 -o baseline.json
+>>python json_data_struct_filter_bench.py -n 20000 --compare baseline.json
+
+Use the same dataset args (-n, --depth, --string-length, --seed) for runs
+that are compared. With --stats, the per filter counters of each case (see
+`json_data_struct_filter.FilterStats`) are included in the results.
+"""
+
+import argparse
+import json
+import platform
+import random
+import string
+import sys
+from time import perf_counter
+
+from json_data_struct_filter import FILTER_TYPES, MODES, FilterStats, compile_filters
+
+
+CATEGORIES = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+FILTER_COUNTS = [1, 8, 64, 128]
+
+
+def generate_dataset(size, depth=3, string_length=32, seed=0):
+    """Generate a list of JSON-like instances, the same for the same args
+
+    Each instance has a top level "id", "category" (one of CATEGORIES) and "text"
+    field, an "optional" field in about half of the instances and a chain of
+    `depth` nested dicts ("nested.level1.level2...") ending in a "text" field.
+
+    Args:
+        size (int): number of instances
+        depth (int): nesting depth of the nested text field
+        string_length (int): length of the text fields
+        seed (int): random seed
+
+    Returns: (list) instances
+    """
+    rand = random.Random(seed)
+    alphabet = string.ascii_lowercase + " "
+    data = []
+    for idx in range(size):
+        leaf = {"text": "".join(rand.choice(alphabet) for _ in range(string_length))}
+        for level in range(depth, 0, -1):
+            leaf = {"level{}".format(level): leaf}
+        instance = {
+            "id": idx,
+            "category": rand.choice(CATEGORIES),
+            "text": "".join(rand.choice(alphabet) for _ in range(string_length)),
+            "nested": leaf,
+        }
+        if rand.random() < 0.5:
+            instance["optional"] = rand.choice(CATEGORIES)
+        data.append(instance)
+    return data
+
+
+def nested_field(depth):
+    """Path of the nested text field of `generate_dataset()` instances"""
+    return ".".join(["nested"] + ["level{}".format(level) for level in range(1, depth + 1)] + ["text"])
+
+
+def make_filters(filter_type, field, count, seed=0):
+    """`count` filters of filter_type on field, with values that match some instances"""
+    rand = random.Random(seed)
+    filters = []
+    for idx in range(count):
+        if field in ("category", "optional"):
+            value = CATEGORIES[idx % len(CATEGORIES)] if idx < len(CATEGORIES) else "category{}".format(idx)
+        else:
+            value = "".join(rand.choice(string.ascii_lowercase) for _ in range(2))
+        if filter_type == "re-match":
+            value = "{}.*".format(value[0])
+        elif filter_type == "re-search":
+            value = "{}[a-z ]{}".format(value[0], value[1])
+        filt = {"type": filter_type, "field": field, "value": value}
+        if filter_type == "replace":
+            filt["replace"] = value.upper()
+        filters.append(filt)
+    return filters
+
+
+def get_cases(depth):
+    """Benchmark cases, as tuples of name, filters, mode and compound"""
+    cases = []
+    for filter_type in FILTER_TYPES:
+        for field_name, field in (("top", "category" if filter_type == "match" else "text"),
+                                  ("nested", nested_field(depth)),
+                                  ("sparse", "optional")):
+            filters = make_filters(filter_type, field, 2)
+            for compound in (True, False):
+                for mode in MODES:
+                    name = "{}/{}/{}/{}".format(
+                        filter_type, field_name, "compound" if compound else "not-compound", mode
+                    )
+                    cases.append((name, filters, mode, compound))
+    for filter_type in ("match", "in", "re-search"):
+        for count in FILTER_COUNTS:
+            filters = make_filters(filter_type, "text", count)
+            for compound in (True, False):
+                name = "{}/count-{}/{}".format(filter_type, count, "compound" if compound else "not-compound")
+                cases.append((name, filters, "inclusive", compound))
+    return cases
+
+
+def run_case(data, filters, mode, compound, repeat, stats=False):
+    """Time filtering data with the case, best of repeat runs
+
+    Returns: (dict) result of the case
+    """
+    plan = compile_filters(filters, mode=mode, compound=compound)
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        results = plan(data)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    result = {
+        "seconds": best,
+        "instances_per_second": len(data) / best if best else None,
+        "returned": len(results),
+    }
+    if stats:
+        filter_stats = FilterStats()
+        compile_filters(filters, mode=mode, compound=compound, stats=filter_stats)(data)
+        result["stats"] = filter_stats.report()
+    return result
+
+
+def compare(results, baseline):
+    """Write the ratio of each case's time to the baseline's to stderr"""
+    baseline_cases = baseline["cases"]
+    if baseline.get("dataset") != results["dataset"]:
+        sys.stderr.write("warning: baseline was run on a different dataset\n")
+    for name, result in results["cases"].items():
+        if name not in baseline_cases:
+            continue
+        ratio = result["seconds"] / baseline_cases[name]["seconds"]
+        sys.stderr.write("{:<40} {:>10.4f}s {:>10.4f}s {:>7.2f}x\n".format(
+            name, baseline_cases[name]["seconds"], result["seconds"], ratio
+        ))
+
+
+def _get_argparser():
+    """to organize and clean format argparser args"""
+    parser = argparse.ArgumentParser(
+        description="Benchmark json_data_struct_filter on a synthetic dataset"
+    )
+
+    parser.add_argument("-n", "--size", action="store", dest="size", type=int, default=10000,
+                        help="number of instances in the dataset")
+    parser.add_argument("--depth", action="store", dest="depth", type=int, default=3,
+                        help="nesting depth of the nested field")
+    parser.add_argument("--string-length", action="store", dest="string_length", type=int, default=32,
+                        help="length of the string fields")
+    parser.add_argument("--seed", action="store", dest="seed", type=int, default=0,
+                        help="random seed of the dataset")
+    parser.add_argument("-r", "--repeat", action="store", dest="repeat", type=int, default=3,
+                        help="number of timed runs per case (the best is reported)")
+    parser.add_argument("-k", "--filter", action="store", dest="filter", default=None,
+                        help="only run cases whose name contains this")
+    parser.add_argument("--stats", action="store_true", dest="stats",
+                        help="include per filter stats in the results")
+    parser.add_argument("-o", "--output", action="store", dest="output", default=None,
+                        help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", action="store", dest="compare", default=None,
+                        help="JSON results of an earlier run to compare against")
+    return parser
+
+
+def main():
+    parser = _get_argparser()
+
+    # parse all args and put in dict
+    args = vars(parser.parse_args())
+
+    dataset = {key: args[key] for key in ("size", "depth", "string_length", "seed")}
+    data = generate_dataset(**dataset)
+    results = {
+        "python": platform.python_version(),
+        "dataset": dataset,
+        "repeat": args["repeat"],
+        "cases": {},
+    }
+    for name, filters, mode, compound in get_cases(args["depth"]):
+        if args["filter"] and args["filter"] not in name:
+            continue
+        results["cases"][name] = run_case(data, filters, mode, compound, args["repeat"], stats=args["stats"])
+
+    if args["output"]:
+        with open(args["output"], 'w') as fh:
+            json.dump(results, fh, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+    if args["compare"]:
+        with open(args["compare"], 'r') as fh:
+            compare(results, json.load(fh))
+
+
+if __name__ == "__main__":
+    main()
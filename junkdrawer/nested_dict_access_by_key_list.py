@@ -5,7 +5,8 @@ Source: https://stackoverflow.com/questions/14692690/access-nested-dictionary-it
 Usage --
 
 ```
-from nested_dict_access_by_key_list import get_by_path, set_by_path, in_nested_path
+from nested_dict_access_by_key_list import get_by_path, set_by_path, in_nested_path, compile_path, get_many, PathSet
+from nested_dict_access_by_key_list import assoc_path, update_paths, FlatView
 
 # retrieve nested dict item
 >>> d = {"1": {"2":{"3": "salvador"}}} 
@@ -40,12 +41,69 @@ from nested_dict_access_by_key_list import get_by_path, set_by_path, in_nested_p
 {'1': {'2': {'3': ['seldon', {'4': 'mallow'}]}}}
 >>> in_nested_path(d, ["1", "2", "3", 1, "4"])
 True
+
+# Compile a path once and reuse it. String paths are dotted, with "[#]" for list
+# indexes, and are only parsed on first use. Misses do not raise (or catch) exceptions.
+>>> d
+{'1': {'2': {'3': ['seldon', {'4': 'mallow'}]}}}
+>>> path = compile_path("1.2.3.[1].4")
+>>> path.get(d)
+'mallow'
+>>> path.contains(d)
+True
+>>> compile_path("1.2.3.[7].4").get_or(d, "hardin")
+'hardin'
+>>> path.set(d, "salvor")
+>>> d
+{'1': {'2': {'3': ['seldon', {'4': 'salvor'}]}}}
+
+# Get many items at once. Paths are merged into a trie so shared prefixes are
+# walked once per structure.
+>>> d = {"1": {"2": {"3": "salvor", "4": "mallow"}}}
+>>> get_many(d, ["1.2.3", "1.2.4", "1.5"], defaults={"1.5": "hardin"})
+('salvor', 'mallow', 'hardin')
+>>> paths = PathSet(["1.2.3", "1.2.4"])
+>>> paths.get(d, as_dict=True)
+{'1.2.3': 'salvor', '1.2.4': 'mallow'}
+>>> paths.get_batch([d, {"1": {}}])
+[('salvor', 'mallow'), (None, None)]
+
+# Update without modifying the original. Only the containers along the updated
+# paths are copied, all other items are shared with the original.
+>>> d = {"1": {"2": {"3": "salvor"}}, "5": ["seldon"]}
+>>> new = assoc_path(d, "1.2.3", "mallow")
+>>> new
+{'1': {'2': {'3': 'mallow'}}, '5': ['seldon']}
+>>> new["5"] is d["5"]
+True
+>>> update_paths(d, {"1.2.4": "hardin", "5.[0]": "dors"})
+{'1': {'2': {'3': 'salvor', '4': 'hardin'}}, '5': ['dors']}
+
+# Look up many paths in one large structure. Each top level item is flattened
+# into a path index on first access, after which lookups are a dict lookup.
+>>> view = FlatView({"1": {"2": {"3": "salvor"}}, "5": ["seldon"]})
+>>> view["1.2.3"]
+'salvor'
+>>> ("5", 0) in view
+True
+>>> view.set("1.2", {"4": "mallow"})
+>>> view.get("1.2.3", "hardin")
+'hardin'
 ```
 
 """
 
-from functools import reduce  # forward compatibility for Python3
+import copy
+from functools import lru_cache, reduce  # forward compatibility for Python3
 import operator
+import re
+
+
+# number of compiled paths kept by compile_path()
+PATH_CACHE_SIZE = 1024
+
+_LIST_INDEX_RE = re.compile(r"\[(-?[0-9]+)\]")
+_MISSING = object()
 
 
 def get_by_path(root, items):
@@ -60,9 +118,381 @@ def set_by_path(root, items, value):
 
 def in_nested_path(root, items):
     """ 'in' equivalent for a nested dict/list structure"""
+    return _walk(root, items) is not _MISSING
+
+
+def compile_path(path):
+    """Compile a path to a `PathAccessor`
+
+    Compiled paths are cached (see PATH_CACHE_SIZE), so calling this with a
+    path that was used recently costs a cache lookup.
+
+    Args:
+        path (str|list|tuple): dotted string, where components of the form "[#]"
+          are list indexes (e.g. "a.[2].b"), or item sequence (e.g. ["a", 2, "b"])
+
+    Returns: (PathAccessor) accessor for path
+    """
+    if not isinstance(path, str):
+        path = tuple(path)
+    return _compile_path(path)
+
+
+class PathAccessor:
+    """Get, test and set the item at a fixed path in nested dict/list structures
+
+    Create with `compile_path()`. Lookups walk the path without raising (or
+    catching) exceptions for missing keys, out of range indexes or non container
+    values on the way, so misses are as cheap as hits.
+    """
+
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        """
+        Args:
+            items (tuple): item sequence
+        """
+        self.items = items
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.items)
+
+    def get(self, root):
+        """Get the item at the path in root, raising KeyError if it is missing"""
+        value = _walk(root, self.items)
+        if value is _MISSING:
+            raise KeyError(self.items)
+        return value
+
+    def get_or(self, root, default=None):
+        """Get the item at the path in root, or default if it is missing"""
+        value = _walk(root, self.items)
+        return default if value is _MISSING else value
+
+    def contains(self, root):
+        """ 'in' equivalent for the path in root"""
+        return _walk(root, self.items) is not _MISSING
+
+    def set(self, root, value):
+        """Set the item at the path in root, raising KeyError if its parent is missing"""
+        if not self.items:
+            raise ValueError("can not set the root of a structure")
+        parent = _walk(root, self.items[:-1])
+        if parent is _MISSING:
+            raise KeyError(self.items[:-1])
+        parent[self.items[-1]] = value
+
+
+def get_many(root, paths, default=None, defaults=None, as_dict=False):
+    """Get the items at many paths in root, walking shared path prefixes once
+
+    To get the same paths from many structures, create a `PathSet` once instead.
+
+    Args:
+        root (dict|list): nested structure
+        paths (list): paths (see `compile_path()`)
+        default: value for paths that are missing from root
+        defaults (dict): value for each path (as supplied) that is missing from root,
+          overriding default
+        as_dict (bool): return a dict keyed by path instead of a tuple
+
+    Returns: (tuple|dict) item (or default) for each path
+    """
+    return PathSet(paths, default=default, defaults=defaults).get(root, as_dict=as_dict)
+
+
+class PathSet:
+    """Get the items at a fixed set of paths from nested dict/list structures
+
+    The paths are merged into a trie, which is compiled to a function that
+    walks each structure once, so prefixes that paths share (e.g. "a.b" of
+    "a.b.c" and "a.b.d") are only looked up once. Missing paths get their
+    default without exceptions being raised (see `PathAccessor`).
+    """
+
+    def __init__(self, paths, default=None, defaults=None):
+        """
+        Args:
+            paths (list): paths (see `compile_path()`)
+            default: value for paths that are missing from a structure
+            defaults (dict): value for each path (as supplied) that is missing from
+              a structure, overriding default
+        """
+        defaults = defaults or {}
+        self.paths = list(paths)
+        self._keys = [path if isinstance(path, str) else tuple(path) for path in self.paths]
+        self._get = _compile_getter(
+            [compile_path(key).items for key in self._keys],
+            [defaults.get(key, default) for key in self._keys],
+        )
+
+    def get(self, root, as_dict=False):
+        """Get the item (or default) at each path in root
+
+        Args:
+            root (dict|list): nested structure
+            as_dict (bool): return a dict keyed by path instead of a tuple
+
+        Returns: (tuple|dict) item (or default) for each path, in path order
+        """
+        if as_dict:
+            return dict(zip(self._keys, self._get(root)))
+        return self._get(root)
+
+    def get_batch(self, roots, as_dict=False):
+        """`get()` for each structure in roots
+
+        Returns: (list) tuple (or dict) of items for each structure
+        """
+        get = self._get
+        if as_dict:
+            keys = self._keys
+            return [dict(zip(keys, get(root))) for root in roots]
+        return [get(root) for root in roots]
+
+
+def assoc_path(root, path, value):
+    """`set_by_path()` equivalent that returns an updated copy of root
+
+    Only the containers along path are copied, so the cost does not depend on
+    the size of root, and all other items are shared between root and the copy
+    (so they must not be modified in place if root should stay unchanged).
+
+    Args:
+        root (dict|list|tuple): nested structure
+        path (str|list|tuple): path (see `compile_path()`), whose parent must be
+          in root (an empty path replaces root)
+        value: new value
+
+    Returns: (dict|list|tuple) updated copy of root
+    """
+    return _update(root, [(compile_path(path).items, value)])
+
+
+def update_paths(root, updates):
+    """`assoc_path()` for many paths, copying each container at most once
+
+    A value for a path nested under another updated path is set in (a copy of)
+    the other path's new value.
+
+    Args:
+        root (dict|list|tuple): nested structure
+        updates (dict): new value for each path (see `compile_path()`)
+
+    Returns: (dict|list|tuple) updated copy of root
+    """
+    return _update(root, [(compile_path(path).items, value) for path, value in updates.items()])
+
+
+class FlatView:
+    """Constant time lookups of paths in a nested dict/list structure
+
+    Indexes each path in the structure, down to every item, in a dict keyed by
+    path tuple. The index is built lazily: the paths under a top level item
+    are indexed on the first lookup of a path under that item.
+
+    Writes must go through `set()`, which updates the index of only the
+    replaced item and the items under it. If the structure is modified in any
+    other way, the view is stale. List indexes in paths must not be negative.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root (dict|list): nested structure
+        """
+        self.root = root
+        self._index = {}
+        self._indexed = set()
+
+    def __getitem__(self, path):
+        value = self.get(path, _MISSING)
+        if value is _MISSING:
+            raise KeyError(path)
+        return value
+
+    def __contains__(self, path):
+        return self.get(path, _MISSING) is not _MISSING
+
+    def get(self, path, default=None):
+        """Get the item at path (see `compile_path()`), or default if it is missing"""
+        if type(path) is not tuple:
+            path = compile_path(path).items
+        if not path:
+            return self.root
+        if path[0] not in self._indexed:
+            self._index_item(path[0])
+        return self._index.get(path, default)
+
+    def set(self, path, value):
+        """Set the item at path (see `compile_path()`), raising KeyError if its parent is missing"""
+        if type(path) is not tuple:
+            path = compile_path(path).items
+        if not path:
+            raise ValueError("can not set the root of a structure")
+        if path[0] not in self._indexed:
+            self._index_item(path[0])
+        parent = self.get(path[:-1], _MISSING)
+        if parent is _MISSING:
+            raise KeyError(path[:-1])
+        old_value = self._index.get(path, _MISSING)
+        parent[path[-1]] = value
+        if old_value is not _MISSING:
+            _unindex(old_value, path, self._index)
+        _index(value, path, self._index)
+
+    def _index_item(self, item):
+        """Index the paths under a top level item"""
+        self._indexed.add(item)
+        value = _step(self.root, item)
+        if value is not _MISSING:
+            _index(value, (item,), self._index)
+
+
+# -- Internal --
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def _compile_path(path):
+    """Cached `compile_path()` for a string or tuple path"""
+    if isinstance(path, str):
+        path = _parse_path(path)
+    return PathAccessor(path)
+
+
+def _parse_path(path):
+    """Expand a dotted path string to an item tuple ("[#]" components are list indexes)"""
+    items = []
+    for component in path.split(".") if path else ():
+        if _LIST_INDEX_RE.fullmatch(component):
+            items.append(int(component[1:-1]))
+        else:
+            items.append(component)
+    return tuple(items)
+
+
+def _compile_getter(item_paths, defaults):
+    """Compile a function that returns the item (or default) at each item path
+
+    Each distinct path prefix is a trie node, looked up once into a local
+    variable of the generated function (from the variable of its parent).
+    """
+    namespace = {"_MISSING": _MISSING, "_step": _step}
+    nodes = {(): 0}
+    lines = ["def get(v0):"]
+    returns = []
+    for slot, (items, default) in enumerate(zip(item_paths, defaults)):
+        for depth in range(1, len(items) + 1):
+            prefix = items[:depth]
+            if prefix not in nodes:
+                node, parent = len(nodes), nodes[items[:depth - 1]]
+                nodes[prefix] = node
+                namespace["i{}".format(node)] = items[depth - 1]
+                lines.append(
+                    "    v{0} = v{1}.get(i{0}, _MISSING) if type(v{1}) is dict else _step(v{1}, i{0})".format(
+                        node, parent
+                    )
+                )
+        namespace["d{}".format(slot)] = default
+        returns.append("d{0} if v{1} is _MISSING else v{1}".format(slot, nodes[items]))
+    lines.append("    return ({}{})".format(", ".join(returns), "," if len(returns) == 1 else ""))
+    exec("\n".join(lines), namespace)
+    return namespace["get"]
+
+
+def _update(root, updates):
+    """Copy root with updates (tuples of item path and value) applied (see `assoc_path()`)"""
+    trie = ({}, [_MISSING])
+    for items, value in updates:
+        node = trie
+        for item in items:
+            node = node[0].setdefault(item, ({}, [_MISSING]))
+        node[1][0] = value
+    return _assoc_trie(root, trie, ())
+
+
+def _assoc_trie(node, trie, path):
+    """Copy node with the values in trie set, copying only the containers on the way"""
+    children, (value,) = trie
+    if value is not _MISSING:
+        node = value
+    elif node is _MISSING:
+        raise KeyError(path)
+    if not children:
+        return node
+
+    node_type = type(node)
+    if node_type is dict or node_type is list:
+        new_node = node_type(node)
+    elif node_type is tuple:
+        new_node = list(node)
+    else:
+        new_node = copy.copy(node)
+    for item, child in children.items():
+        new_node[item] = _assoc_trie(_step(node, item), child, path + (item,))
+    return tuple(new_node) if node_type is tuple else new_node
+
+
+def _index(value, path, index):
+    """Add path and the paths of all items under value to index"""
+    index[path] = value
+    value_type = type(value)
+    if value_type is dict:
+        for item, child in value.items():
+            _index(child, path + (item,), index)
+    elif value_type is list or value_type is tuple:
+        for item, child in enumerate(value):
+            _index(child, path + (item,), index)
+
+
+def _unindex(value, path, index):
+    """Remove path and the paths of all items under value from index (see `_index()`)"""
+    del index[path]
+    value_type = type(value)
+    if value_type is dict:
+        for item, child in value.items():
+            _unindex(child, path + (item,), index)
+    elif value_type is list or value_type is tuple:
+        for item, child in enumerate(value):
+            _unindex(child, path + (item,), index)
+
+
+def _step(node, item):
+    """Get item of node, or _MISSING if it (or node) is not present (see `_walk()`)"""
+    if node is _MISSING:
+        return _MISSING
+    node_type = type(node)
+    if node_type is dict:
+        return node.get(item, _MISSING)
+    if node_type is list or node_type is tuple:
+        if type(item) is not int or not -len(node) <= item < len(node):
+            return _MISSING
+        return node[item]
     try:
-        get_by_path(root, items)
-    except KeyError:
-        return False
+        return node[item]
+    except (KeyError, IndexError, TypeError):
+        return _MISSING
+
+
+def _walk(node, items):
+    """Get the item at items in node, or _MISSING if it is not present
 
-    return True
+    Dicts and lists are walked without exceptions. Other containers fall back to
+    indexing, with lookup errors treated as misses. (`_step()`, inlined.)
+    """
+    for item in items:
+        node_type = type(node)
+        if node_type is dict:
+            node = node.get(item, _MISSING)
+            if node is _MISSING:
+                return _MISSING
+        elif node_type is list or node_type is tuple:
+            if type(item) is not int or not -len(node) <= item < len(node):
+                return _MISSING
+            node = node[item]
+        else:
+            try:
+                node = node[item]
+            except (KeyError, IndexError, TypeError):
+                return _MISSING
+    return node
@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# junkdrawer modules import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def record_fp(tmp_path):
+    """Recording file in a temporary directory"""
+    return str(tmp_path / "add_monitor.bin")
@@ -0,0 +1,409 @@
+import asyncio
+import json
+import os
+import struct
+import threading
+
+import pytest
+
+from func_io_monitor import (BINARY_COMPRESSIONS, RECORD_TYPES, BinaryRecordReader, EveryNSampler, ProbabilitySampler,
+ TokenBucketSampler, func_io_monitor, get_recorder, load_recording, merge_shards, shard_fps, _FOOTER_LENGTH,
+ _FOOTER_MAGIC, _SEGMENT_HEADER, _SEGMENT_MAGIC, _SEGMENT_VERSION, _read_varint, _recorder_background, _segment_fps,
+ _unzigzag, _write_varint, _zigzag)
+
+
+def record_calls(recorder, calls, start=1597074458.0):
+    """Record calls of add(idx, 1) at one second intervals from start"""
+    for idx in range(calls):
+        recorder.record("__main__.<none>.add", {"args": [idx, 1], "kwargs": {}}, str(idx + 1), timestamp=start + idx)
+
+
+def add(x, y):
+    return x + y
+
+
+async def double(x):
+    await asyncio.sleep(0)
+    return x * 2
+
+
+def count_up(n):
+    for idx in range(n):
+        yield idx
+    return n
+
+
+def echo():
+    received = yield "ready"
+    while True:
+        received = yield received
+
+
+async def count_up_async(n):
+    for idx in range(n):
+        await asyncio.sleep(0)
+        yield idx
+
+
+def key_of(name):
+    """Function key of a test module function"""
+    return "{}.<none>.{}".format(__name__, name)
+
+
+class GatedRecorder:
+    """Recorder whose first record waits until the gate is opened, to hold up a writer thread"""
+    def __init__(self):
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.outputs = []
+
+    def record(self, function_key, input_, output):
+        self.started.set()
+        self.gate.wait(5)
+        self.outputs.append(output)
+
+
+def run_in_child(func):
+    """Run func in a forked child process and wait for it"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func()
+        finally:
+            os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+
+
+class Test_Varint:
+    """ """
+    @pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 2 ** 32, 2 ** 63 - 1])
+    def test_round_trip(self, value):
+        """Tests _write_varint() and _read_varint()"""
+        buffer = bytearray(b"\xff")
+        _write_varint(buffer, value)
+        assert _read_varint(buffer, 1) == (value, len(buffer))
+
+    def test_length(self):
+        """Tests that varints use 7 bits per byte"""
+        for value, length in [(0, 1), (127, 1), (128, 2), (2 ** 14 - 1, 2), (2 ** 14, 3)]:
+            buffer = bytearray()
+            _write_varint(buffer, value)
+            assert len(buffer) == length
+
+    @pytest.mark.parametrize("value", [0, 1, -1, 63, -64, 64, -65, 2 ** 40, -2 ** 40])
+    def test_zigzag_round_trip(self, value):
+        """Tests _zigzag() and _unzigzag()"""
+        assert _zigzag(value) >= 0
+        assert _unzigzag(_zigzag(value)) == value
+
+    def test_zigzag_small(self):
+        """Tests that small magnitudes map to small values"""
+        assert [_zigzag(value) for value in [0, -1, 1, -2, 2]] == [0, 1, 2, 3, 4]
+
+
+class Test_Binary_Segments:
+    """ """
+    def test_header(self, record_fp):
+        """Tests the segment header"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp, compression="zlib")
+        recorder.close()
+        with open(record_fp + ".000000", 'rb') as fh:
+            data = fh.read()
+        magic, version, compression, _ = _SEGMENT_HEADER.unpack_from(data, 0)
+        assert (magic, version, compression) == (_SEGMENT_MAGIC, _SEGMENT_VERSION, BINARY_COMPRESSIONS["zlib"])
+
+    def test_footer(self, record_fp):
+        """Tests the index of function keys in the footer of a complete segment"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp)
+        record_calls(recorder, 3)
+        recorder.record("__main__.<none>.sub", {"args": [1, 1], "kwargs": {}}, "0", timestamp=1597074460.5)
+        recorder.close()
+        with open(record_fp + ".000000", 'rb') as fh:
+            data = fh.read()
+        assert data[-len(_FOOTER_MAGIC):] == _FOOTER_MAGIC
+        footer_end = len(data) - len(_FOOTER_MAGIC) - _FOOTER_LENGTH.size
+        (footer_length,) = _FOOTER_LENGTH.unpack_from(data, footer_end)
+        footer = json.loads(data[footer_end - footer_length:footer_end])
+        assert footer == {"keys": {
+            "__main__.<none>.add": [3, 1597074458000000, 1597074460000000],
+            "__main__.<none>.sub": [1, 1597074460500000, 1597074460500000],
+        }}
+        assert BinaryRecordReader(record_fp).keys() == {
+            "__main__.<none>.add": {"count": 3, "start": 1597074458.0, "end": 1597074460.0},
+            "__main__.<none>.sub": {"count": 1, "start": 1597074460.5, "end": 1597074460.5},
+        }
+
+    def test_records(self, record_fp):
+        """Tests that a key record precedes the first call record of a key, with time deltas"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp)
+        record_calls(recorder, 2)
+        recorder.close()
+        with open(record_fp + ".000000", 'rb') as fh:
+            data = fh.read()
+        _, _, _, time_us = _SEGMENT_HEADER.unpack_from(data, 0)
+        pos = _SEGMENT_HEADER.size
+        length, pos = _read_varint(data, pos)
+        assert data[pos:pos + length] == b"\x00\x00__main__.<none>.add"
+        pos += length
+        times = []
+        for idx in range(2):
+            length, pos = _read_varint(data, pos)
+            record_end = pos + length
+            assert data[pos] == 1
+            key_id, pos = _read_varint(data, pos + 1)
+            delta, pos = _read_varint(data, pos)
+            time_us += _unzigzag(delta)
+            times.append(time_us)
+            assert key_id == 0
+            assert json.loads(data[pos:record_end]) == {"in": {"args": [idx, 1], "kwargs": {}}, "out": str(idx + 1)}
+            pos = record_end
+        assert times == [1597074458000000, 1597074459000000]
+
+    @pytest.mark.parametrize("compression", [None, "zlib", "lzma"])
+    def test_rotation(self, record_fp, compression):
+        """Tests that records are read back across segments of segment_size"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp, segment_size=200, compression=compression)
+        record_calls(recorder, 20)
+        recorder.close()
+        assert len(_segment_fps(record_fp)) > 1
+        records = list(BinaryRecordReader(record_fp).iter_records())
+        assert [record["in"]["args"][0] for record in records] == list(range(20))
+        assert records[0] == {
+            "key": "__main__.<none>.add", "time": 1597074458.0, "in": {"args": [0, 1], "kwargs": {}}, "out": "1"
+        }
+
+    def test_time_range(self, record_fp):
+        """Tests that iter_records() only yields records of the function key and time range"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp, segment_size=200)
+        record_calls(recorder, 20)
+        recorder.record("__main__.<none>.sub", {"args": [1, 1], "kwargs": {}}, "0", timestamp=1597074460.5)
+        recorder.close()
+        records = BinaryRecordReader(record_fp).iter_records("__main__.<none>.add", start=1597074460.0, end=1597074463.0)
+        assert [record["time"] for record in records] == [1597074460.0, 1597074461.0, 1597074462.0]
+
+    def test_incomplete_segment(self, record_fp):
+        """Tests that the flushed records of a segment without a footer are read"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp)
+        record_calls(recorder, 3)
+        recorder.flush()
+        try:
+            assert len(list(BinaryRecordReader(record_fp).iter_records())) == 3
+            # only complete segments are indexed
+            assert BinaryRecordReader(record_fp).keys() == {}
+            # an incomplete record is not read
+            with open(record_fp + ".000000", 'ab') as fh:
+                fh.write(struct.pack("B", 100) + b"\x01")
+            assert len(list(BinaryRecordReader(record_fp).iter_records())) == 3
+        finally:
+            recorder.close()
+
+    def test_closed(self, record_fp):
+        """Tests that records added to a closed recorder are dropped and counted"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp)
+        recorder.close()
+        record_calls(recorder, 2)
+        assert recorder.dropped == 2
+        assert recorder.dropped_by_key == {"__main__.<none>.add": 2}
+        assert list(BinaryRecordReader(record_fp).iter_records()) == []
+
+
+class Test_Binary_Shards:
+    """ """
+    def test_shards(self, record_fp):
+        """Tests that the segments of shards are read with the recording, in time order"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp, shard=True)
+        record_calls(recorder, 3)
+        recorder.close()
+        # the shard of another process
+        shard_fp = record_fp.replace(".bin", ".1.bin")
+        other = get_recorder(RECORD_TYPES.binary, shard_fp)
+        record_calls(other, 3, start=1597074458.5)
+        other.close()
+
+        assert shard_fps(record_fp, record_type=RECORD_TYPES.binary) == sorted([recorder.fp, shard_fp])
+        times = [record["time"] for record in BinaryRecordReader(record_fp).iter_records()]
+        assert times == sorted(times) and len(times) == 6
+        assert len(load_recording(record_fp, record_type=RECORD_TYPES.binary)["__main__.<none>.add"]) == 6
+
+    def test_merge_shards(self, record_fp, tmp_path):
+        """Tests merge_shards() of a binary recording"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp, shard=True, compression="zlib")
+        record_calls(recorder, 3)
+        recorder.close()
+        output_fp = str(tmp_path / "merged.bin")
+        assert merge_shards(record_fp, output_fp, record_type=RECORD_TYPES.binary, compression="lzma") == 1
+        assert list(BinaryRecordReader(output_fp).iter_records()) == list(BinaryRecordReader(record_fp).iter_records())
+        with open(_segment_fps(output_fp)[0], 'rb') as fh:
+            assert _SEGMENT_HEADER.unpack_from(fh.read(), 0)[2] == BINARY_COMPRESSIONS["lzma"]
+
+
+class Test_Binary_Fork:
+    """ """
+    def test_fork(self, record_fp):
+        """Tests that a forked child writes its own segment, not the parent's buffered records"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp)
+        record_calls(recorder, 2)
+
+        def child():
+            record_calls(recorder, 3, start=1597074470.0)
+            recorder.close()
+        run_in_child(child)
+        recorder.close()
+
+        segments = _segment_fps(record_fp)
+        assert len(segments) == 2
+        counts = sorted(
+            len(list(BinaryRecordReader(record_fp).iter_records(start=start, end=start + 10)))
+            for start in [1597074458.0, 1597074470.0]
+        )
+        assert counts == [2, 3]
+        assert BinaryRecordReader(record_fp).keys()["__main__.<none>.add"]["count"] == 5
+
+    def test_fork_shard(self, record_fp):
+        """Tests that a forked child of a sharded recorder writes its own shard"""
+        recorder = get_recorder(RECORD_TYPES.binary, record_fp, shard=True)
+        record_calls(recorder, 2)
+
+        def child():
+            record_calls(recorder, 3, start=1597074470.0)
+            recorder.close()
+        run_in_child(child)
+        recorder.close()
+
+        shards = shard_fps(record_fp, record_type=RECORD_TYPES.binary)
+        assert len(shards) == 2
+        assert sorted(len(list(BinaryRecordReader(fp, shards=False).iter_records())) for fp in shards) == [2, 3]
+        assert len(list(BinaryRecordReader(record_fp).iter_records())) == 5
+
+
+class Test_Samplers:
+    """ """
+    def test_every_n(self, record_fp):
+        """Tests that every n-th call of each function is recorded, starting with the first"""
+        sampler = EveryNSampler(3)
+        recorder = get_recorder(RECORD_TYPES.jsonl, record_fp)
+        add_monitor = func_io_monitor(add, recorder=recorder, sampler=sampler)
+        count_up_monitor = func_io_monitor(count_up, recorder=recorder, sampler=sampler)
+        assert [add_monitor(idx, 1) for idx in range(7)] == list(range(1, 8))
+        assert [list(count_up_monitor(idx)) for idx in range(4)] == [list(range(idx)) for idx in range(4)]
+        recorder.close()
+        recording = load_recording(record_fp)
+        assert [record["in"]["args"][0] for record in recording[key_of("add")]] == [0, 3, 6]
+        assert [record["in"]["args"][0] for record in recording[key_of("count_up")]] == [0, 3]
+
+    def test_probability(self, record_fp):
+        """Tests that no calls are recorded with probability 0, and all with probability 1"""
+        recorder = get_recorder(RECORD_TYPES.jsonl, record_fp)
+        for probability, name in [(0, "add"), (1, "count_up")]:
+            monitor = func_io_monitor(globals()[name], recorder=recorder, sampler=ProbabilitySampler(probability))
+            for idx in range(5):
+                list(monitor(idx)) if name == "count_up" else monitor(idx, 1)
+        recorder.close()
+        recording = load_recording(record_fp)
+        assert key_of("add") not in recording and len(recording[key_of("count_up")]) == 5
+
+    def test_token_bucket(self, record_fp):
+        """Tests that at most the burst is recorded before the bucket refills"""
+        recorder = get_recorder(RECORD_TYPES.jsonl, record_fp)
+        add_monitor = func_io_monitor(add, recorder=recorder, sampler=TokenBucketSampler(0.001, burst=2))
+        for idx in range(5):
+            add_monitor(idx, 1)
+        recorder.close()
+        assert len(load_recording(record_fp)[key_of("add")]) == 2
+
+
+class Test_Background_Overflow:
+    """ """
+    @pytest.mark.parametrize("overflow, outputs", [("drop-newest", ["1", "2", "3"]), ("drop-oldest", ["1", "5", "6"])])
+    def test_drop(self, overflow, outputs):
+        """Tests which calls are dropped when the queue is full, and that they are counted"""
+        gated = GatedRecorder()
+        recorder = _recorder_background(gated, queue_size=2, overflow=overflow)
+        add_monitor = func_io_monitor(add, recorder=recorder)
+        add_monitor(0, 1)
+        assert gated.started.wait(5)
+        for idx in range(1, 6):
+            add_monitor(idx, 1)
+        assert recorder.dropped == 3
+        gated.gate.set()
+        recorder.close()
+        assert gated.outputs == outputs
+        add_monitor(6, 1)
+        assert recorder.dropped == 4 and recorder.dropped_by_key == {key_of("add"): 4}
+
+    def test_block(self, record_fp):
+        """Tests that no calls are dropped by a blocking queue"""
+        recorder = get_recorder(RECORD_TYPES.jsonl, record_fp, background=True, queue_size=1)
+        add_monitor = func_io_monitor(add, recorder=recorder)
+        for idx in range(200):
+            add_monitor(idx, 1)
+        recorder.close()
+        assert recorder.dropped == 0
+        assert [record["out"] for record in load_recording(record_fp)[key_of("add")]] == [
+            str(idx + 1) for idx in range(200)
+        ]
+
+
+class Test_Stream_Monitors:
+    """ """
+    def test_coroutine(self, record_fp):
+        """Tests that coroutine monitors record the awaited output"""
+        recorder = get_recorder(RECORD_TYPES.jsonl, record_fp)
+        double_monitor = func_io_monitor(double, recorder=recorder, timing=True)
+        assert asyncio.run(double_monitor(3)) == 6
+        recorder.close()
+        (record,) = load_recording(record_fp)[key_of("double")]
+        assert (record["in"], record["out"]) == ({"args": [3], "kwargs": {}}, "6")
+        assert record["wall_ns"] >= record["cpu_ns"] > 0
+
+    def test_generator(self, record_fp):
+        """Tests that generator monitors record the first item_cap items and the count of a stream"""
+        recorder = get_recorder(RECORD_TYPES.jsonl, record_fp)
+        count_up_monitor = func_io_monitor(count_up, recorder=recorder, item_cap=2, output_log_formatter=repr)
+        assert list(count_up_monitor(5)) == [0, 1, 2, 3, 4]
+        stream = count_up_monitor(10)
+        assert [next(stream), next(stream), next(stream)] == [0, 1, 2]
+        stream.close()
+        assert list(count_up_monitor(0)) == []
+        recorder.close()
+        outputs = [record["out"] for record in load_recording(record_fp)[key_of("count_up")]]
+        assert outputs == [
+            {"items": ["0", "1"], "count": 5}, {"items": ["0", "1"], "count": 3}, {"items": [], "count": 0}
+        ]
+
+    def test_generator_protocol(self, record_fp):
+        """Tests that return values and sent values pass through generator monitors"""
+        recorder = get_recorder(RECORD_TYPES.jsonl, record_fp)
+        count_up_monitor = func_io_monitor(count_up, recorder=recorder)
+
+        def delegate():
+            return (yield from count_up_monitor(2))
+        stream = delegate()
+        assert (next(stream), next(stream)) == (0, 1)
+        with pytest.raises(StopIteration) as stop:
+            next(stream)
+        assert stop.value.value == 2
+
+        stream = func_io_monitor(echo, recorder=recorder)()
+        assert next(stream) == "ready"
+        assert stream.send("a") == "a" and stream.send("b") == "b"
+        stream.close()
+        recorder.close()
+        assert load_recording(record_fp)[key_of("echo")][0]["out"] == {"items": ["ready", "a", "b"], "count": 3}
+
+    def test_async_generator(self, record_fp):
+        """Tests that async generator monitors record as generator monitors do"""
+        recorder = get_recorder(RECORD_TYPES.jsonl, record_fp)
+        count_up_monitor = func_io_monitor(count_up_async, recorder=recorder, item_cap=1)
+
+        async def consume():
+            items = [idx async for idx in count_up_monitor(3)]
+            stream = count_up_monitor(5)
+            await stream.__anext__()
+            await stream.aclose()
+            return items
+        assert asyncio.run(consume()) == [0, 1, 2]
+        recorder.close()
+        outputs = [record["out"] for record in load_recording(record_fp)[key_of("count_up_async")]]
+        assert outputs == [{"items": ["0"], "count": 3}, {"items": ["0"], "count": 1}]
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from func_io_monitor import RECORD_TYPES, func_io_monitor, get_recorder
+from func_io_monitor_replay import replay
+
+
+async def fetch(x):
+    await asyncio.sleep(0.01)
+    return x * 2
+
+
+def count_up(n):
+    for idx in range(n):
+        yield idx
+
+
+async def count_up_async(n):
+    for idx in range(n):
+        await asyncio.sleep(0)
+        yield idx
+
+
+def add(x, y):
+    return x + y
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    """JSON lines recorder in a temporary directory"""
+    recorder = get_recorder(RECORD_TYPES.jsonl, str(tmp_path / "replay.jsonl"))
+    yield recorder
+    recorder.close()
+
+
+def result_of(results, name):
+    """Result of the function key of a test module function"""
+    return results["{}.<none>.{}".format(__name__, name)]
+
+
+class Test_Replay:
+    """ """
+    def test_function(self, recorder):
+        """Tests that outputs are compared and mismatches counted"""
+        add_monitor = func_io_monitor(add, recorder=recorder)
+        add_monitor(1, 2)
+        recorder.record("{}.<none>.add".format(__name__), {"args": [1, 1], "kwargs": {}}, "3")
+        recorder.record("{}.<none>.add".format(__name__), "1 + 1", "2")
+        recorder.close()
+        result = result_of(replay(recorder.fp), "add")
+        assert {key: result[key] for key in ("calls", "mismatches", "errors", "skipped")} == {
+            "calls": 2, "mismatches": 1, "errors": 0, "skipped": 1
+        }
+
+    def test_coroutine(self, recorder):
+        """Tests that coroutines are awaited, and timed until they complete"""
+        fetch_monitor = func_io_monitor(fetch, recorder=recorder)
+        asyncio.run(fetch_monitor(3))
+        recorder.close()
+        result = result_of(replay(recorder.fp, repeat=2), "fetch")
+        assert (result["calls"], result["mismatches"], result["errors"]) == (2, 0, 0)
+        assert result["latency"]["p50"] >= 10 ** 7
+
+    def test_generator(self, recorder):
+        """Tests that generators are consumed as far as recorded, and compared with the recorded items"""
+        count_up_monitor = func_io_monitor(count_up, recorder=recorder, item_cap=2)
+        list(count_up_monitor(5))
+        stream = count_up_monitor(10)
+        next(stream), next(stream), next(stream)
+        stream.close()
+        list(count_up_monitor(0))
+        recorder.record("{}.<none>.count_up".format(__name__), {"args": [2], "kwargs": {}}, {"items": ["0"], "count": 2})
+        recorder.record("{}.<none>.count_up".format(__name__), {"args": [2], "kwargs": {}}, {"items": ["0"], "count": 3})
+        recorder.close()
+        result = result_of(replay(recorder.fp), "count_up")
+        assert (result["calls"], result["mismatches"], result["errors"]) == (5, 1, 0)
+
+    def test_async_generator(self, recorder):
+        """Tests that async generators are consumed as far as recorded"""
+        count_up_monitor = func_io_monitor(count_up_async, recorder=recorder)
+
+        async def consume():
+            return [idx async for idx in count_up_monitor(3)]
+        asyncio.run(consume())
+        recorder.close()
+        result = result_of(replay(recorder.fp), "count_up_async")
+        assert (result["calls"], result["mismatches"], result["errors"]) == (1, 0, 0)
+
+    def test_loop(self, recorder):
+        """Tests that a supplied event loop is used, and not closed"""
+        fetch_monitor = func_io_monitor(fetch, recorder=recorder)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(fetch_monitor(3))
+            recorder.close()
+            assert result_of(replay(recorder.fp, loop=loop), "fetch")["mismatches"] == 0
+            assert not loop.is_closed()
+        finally:
+            loop.close()
+
+    def test_unresolved(self):
+        """Tests that a function key that can not be resolved does not stop the replay"""
+        record = {"in": {"args": [1, 2], "kwargs": {}}, "out": "3"}
+        results = replay({"gone.<none>.f": [record], "{}.<none>.add".format(__name__): [record]})
+        assert results["gone.<none>.f"]["unresolved"] == 1
+        assert results["gone.<none>.f"]["resolve_error"].startswith("ModuleNotFoundError")
+        assert result_of(results, "add")["calls"] == 1
@@ -0,0 +1,313 @@
+import copy
+import json
+import random
+import re
+
+import pytest
+
+from json_data_struct_filter import (COPY_MODES, RAW_DECODE_TRIALS, FilterStats, IndexedDataset, compile_filters,
+ filter_data, iter_filter_data, _CompiledFilter, _decode_raw_keys, _fuse_regexes, _raw_keys)
+
+
+def make_filter(type_, field, value, replace=None):
+    """Filter in the filter format of `filter_data()`"""
+    filt = {"type": type_, "field": field, "value": value}
+    if replace is not None:
+        filt["replace"] = replace
+    return filt
+
+
+class Test_Regex_Fusion:
+    """ """
+    @pytest.mark.parametrize("pattern", ["(?i)zzz", "(?x) z z z", "(?ms)zzz", "(?a)zzz", r"(a)\1", "(?P<a>a)(?P=a)"])
+    def test_unfusable(self, pattern):
+        """Tests that patterns which change meaning in an alternation are not fused"""
+        filters = [_CompiledFilter(make_filter("re-search", "a", value)) for value in [pattern, "abc"]]
+        assert _fuse_regexes(filters) is None
+
+    def test_scoped_flags(self):
+        """Tests that patterns with scoped inline flags are fused"""
+        filters = [
+            _CompiledFilter(make_filter("re-search", "a", "(?i:zzz)")), _CompiledFilter(make_filter("re-match", "a", "b"))
+        ]
+        regex = _fuse_regexes(filters)
+        assert regex.search("ZZZ") and regex.search("bc") and not regex.search("cb")
+
+    def test_global_flag(self):
+        """Tests that a global inline flag of one filter does not apply to the others"""
+        data = [{"a": "ABC"} for _ in range(200)]
+        filters = [make_filter("re-search", "a", "(?i)zzz"), make_filter("re-search", "a", "abc")]
+        assert filter_data(data, filters, compound=False) == []
+        plan = compile_filters(filters, compound=False)
+        assert [plan.matches(instance) for instance in data] == [False] * 200
+
+
+class Test_Raw:
+    """ """
+    @pytest.mark.parametrize("raw, expected", [
+        ('{"a": 1, "b": {"a": 2}}', {"a": 1}),
+        ('{"b": {"a": 2}, "c": [{"a": 3}]}', {}),
+        ('{"b": "x\\"y", "a" : [1, {"a": 2}]}', {"a": [1, {"a": 2}]}),
+        ('{"b": "\\"a\\": 1", "c": "a"}', {}),
+        ('{"b": "{[", "a": 1}', {"a": 1}),
+        ('{"a": 1, "a": 2}', {"a": 2}),
+        ('{"a": {"a": 1}, "ab": 2}', {"a": {"a": 1}, "ab": 2}),
+        ('{"\\u0061": 1}', {"a": 1}),
+        ('[{"a": 1}]', [{"a": 1}]),
+    ])
+    def test_decode_raw_keys(self, raw, expected):
+        """Tests that only the top level keys are decoded, or raw in full if it could hide them"""
+        regex, escapes = _raw_keys([("a", "x"), ("ab",)])
+        assert _decode_raw_keys(raw, regex, escapes) == expected
+
+    def test_matches_raw(self):
+        """Tests that raw records match as their decoded instances, with either decoding"""
+        filters = [make_filter("match", "status", "ok"), make_filter("in", "user.name", "bo")]
+        instances = [
+            {"status": "ok", "user": {"name": "bob"}, "other": [{"status": "err"}]},
+            {"user": {"name": "bob"}, "status": "err", "nested": {"status": "ok"}},
+            {"other": "\"status\": \"ok\"", "status": "ok", "user": {"name": "al"}},
+            {"status": "ok", "user": {"name": "bob"}, "status ": "err"},
+            {},
+        ] * RAW_DECODE_TRIALS
+        plan = compile_filters(filters)
+        for instance in instances:
+            raw = json.dumps(instance)
+            assert plan.matches_raw(raw) is plan.matches(instance)
+            assert plan.matches_raw(raw.encode()) is plan.matches(instance)
+        raws = [json.dumps(instance) for instance in instances]
+        assert list(plan.iter_raw(raws)) == [raw for raw, instance in zip(raws, instances) if plan.matches(instance)]
+
+
+class Test_Missing_Fields:
+    """ """
+    data = [
+        {"a": [{"b": "x"}]},
+        {"a": []},
+        {"a": "x"},
+        {"a": [5]},
+        {"c": 1},
+    ]
+
+    @pytest.mark.parametrize("filt", [
+        make_filter("match", "a.[0].b", "x"),
+        make_filter("in", "a.[0].b", "x"),
+        make_filter("re-search", "a.[0].b", "x"),
+    ])
+    def test_filter_data(self, filt):
+        """Tests that short lists and paths through scalars are missing fields"""
+        assert filter_data(self.data, [filt]) == [{"a": [{"b": "x"}]}]
+        assert len(filter_data(self.data, [filt], mode="exclusive")) == 4
+        stats = FilterStats()
+        filter_data(self.data, [filt], stats=stats)
+        assert stats.report()[0]["path_misses"] == 4
+
+    def test_replace(self):
+        """Tests that 'replace' filters skip instances without the field"""
+        result = filter_data(self.data, [make_filter("replace", "a.[0].b", "x", "y")])
+        assert result == [{"a": [{"b": "y"}]}] + self.data[1:]
+
+    @pytest.mark.parametrize("match_fields", [[], ["a.[0].b"]])
+    def test_indexed_dataset(self, match_fields):
+        """Tests that queries with and without an index agree with filter_data()"""
+        dataset = IndexedDataset(self.data, match_fields=match_fields)
+        filters = [make_filter("match", "a.[0].b", "x")]
+        assert dataset.query(filters) == filter_data(self.data, filters)
+        assert dataset.query(filters, mode="exclusive") == filter_data(self.data, filters, mode="exclusive")
+
+
+def reference_filter_data(data, filters, mode="inclusive", compound=True):
+    """The original `filter_data()` loop, for filters other than 'replace' filters
+
+    As documented, a list index past the end of a list or a path through a value
+    that is not a dict/list is a missing field (the original raised IndexError or
+    TypeError for those).
+    """
+    def field_value(instance, field):
+        value = instance
+        for component in field.split("."):
+            if re.match(r"\[[0-9]+\]", component):
+                component = int(component.strip("[]"))
+            try:
+                value = value[component]
+            except (KeyError, IndexError, TypeError):
+                return MISSING
+        return value
+
+    results = []
+    for instance in copy.deepcopy(data):
+        match_count = 0
+        for filt in filters:
+            value = field_value(instance, filt["field"])
+            if value is MISSING:
+                continue
+            if filt["type"] == "match":
+                matched = value == filt["value"]
+            elif filt["type"] == "in":
+                matched = filt["value"] in value
+            elif filt["type"] == "re-match":
+                matched = re.match(filt["value"], value)
+            else:
+                matched = re.search(filt["value"], value)
+            if matched:
+                match_count += 1
+                if not compound:
+                    break
+        match = match_count == len(filters) if compound else match_count > 0
+        if match == (mode == "inclusive"):
+            results.append(instance)
+    return results
+
+
+MISSING = object()
+
+NAMES = ["hari seldon", "salvor hardin", "hober mallow", "the mule", "bayta darell", "Ebling Mis", ""]
+KINDS = ["trader", "mayor", "psychohistorian", "mentalic"]
+
+
+def random_instance(rng):
+    """Data instance with some of its fields missing, or of an unexpected shape"""
+    instance = {}
+    if rng.random() < 0.8:
+        instance["name"] = rng.choice(NAMES)
+    instance["tags"] = rng.sample(KINDS, rng.randint(0, 3))
+    shape = rng.random()
+    if shape < 0.6:
+        instance["meta"] = {"kind": rng.choice(KINDS), "level": rng.randint(0, 3)}
+    elif shape < 0.8:
+        instance["meta"] = rng.choice(KINDS)
+    return instance
+
+
+def random_filter(rng):
+    """Filter on a field that may be missing from an instance, but is never of the wrong type"""
+    string_fields = ["name", "meta.kind", "tags.[0]", "tags.[2]"]
+    kind = rng.choice(["match", "match", "in", "in", "re-match", "re-search", "re-search"])
+    if kind == "match":
+        field = rng.choice(string_fields + ["meta.level"])
+        value = rng.randint(0, 3) if field == "meta.level" else rng.choice(NAMES + KINDS)
+    elif kind == "in":
+        field = rng.choice(string_fields + ["tags"])
+        word = rng.choice(NAMES + KINDS)
+        value = word if field == "tags" else word[:rng.randint(1, 4)]
+    else:
+        field = rng.choice(string_fields)
+        value = rng.choice(["h.r", "^the", "m[a-z]+l", "(?i:mis)", "er$", "o", "(tr|m)a", "mule|mayor", "x?"])
+    return make_filter(kind, field, value)
+
+
+class Test_Parity:
+    """ """
+    data = [random_instance(random.Random(seed)) for seed in range(300)]
+
+    @pytest.mark.parametrize("mode", ["inclusive", "exclusive"])
+    @pytest.mark.parametrize("compound", [True, False])
+    def test_filter_data(self, mode, compound):
+        """Tests that filter_data() returns what the original filter_data() did"""
+        rng = random.Random(f"{mode}-{compound}")
+        for _ in range(40):
+            filters = [random_filter(rng) for _ in range(rng.randint(1, 2 if compound else 5))]
+            expected = reference_filter_data(self.data, filters, mode=mode, compound=compound)
+            assert filter_data(self.data, filters, mode=mode, compound=compound) == expected, filters
+            assert list(iter_filter_data(iter(self.data), filters, mode=mode, compound=compound)) == expected
+
+    @pytest.mark.parametrize("compound", [True, False])
+    def test_same_field(self, compound):
+        """Tests many filters on one field, which are fused or combined into one test"""
+        rng = random.Random(compound)
+        for type_, values in [
+            ("in", [name[idx:idx + 3] for name in NAMES for idx in range(0, 12, 2)]),
+            ("re-search", ["h.r", "(?i:mis)", "er$", "^the", "m[a-z]+l", r"\bmal"]),
+            ("match", NAMES + KINDS),
+        ]:
+            filters = [make_filter(type_, "name", value) for value in values]
+            filters = rng.sample(filters, len(filters))
+            for size in [2, len(filters)]:
+                expected = reference_filter_data(self.data, filters[:size], compound=compound)
+                assert filter_data(self.data, filters[:size], compound=compound) == expected, filters[:size]
+
+    def test_plan_reuse(self):
+        """Tests that a plan gives the same results once it has reordered its filters"""
+        rng = random.Random(1)
+        filters = [random_filter(rng) for _ in range(4)]
+        plan = compile_filters(filters, compound=False)
+        expected = reference_filter_data(self.data, filters, compound=False)
+        for _ in range(10):
+            assert plan(self.data) == expected
+
+    @pytest.mark.parametrize("copy_mode", COPY_MODES)
+    def test_copy(self, copy_mode):
+        """Tests which returned instances are copies of the supplied instances"""
+        data = [{"a": {"b": "x"}}, {"a": {"b": "y"}}]
+        result = filter_data(data, [make_filter("match", "a.b", "x")], copy=copy_mode)
+        assert result == [{"a": {"b": "x"}}]
+        assert (result[0] is data[0]) is (copy_mode == "none")
+
+
+class Test_Replace:
+    """ """
+    @pytest.mark.parametrize("stats", [None, FilterStats()])
+    def test_order(self, stats):
+        """Tests that 'replace' filters on a field are applied in the order given"""
+        filters = [make_filter("replace", "a", "a", "b"), make_filter("replace", "a", "b", "c")]
+        assert filter_data([{"a": "ab"}], filters, stats=stats) == [{"a": "cc"}]
+        assert filter_data([{"a": "ab"}], filters[::-1], stats=stats) == [{"a": "bc"}]
+
+    def test_groups(self):
+        """Tests that only the first group of a pattern with groups is replaced"""
+        filters = [make_filter("replace", "a", "(e)(r)", "0"), make_filter("replace", "a", "(x)?a", "4")]
+        assert filter_data([{"a": "hober mallow"}], filters) == [{"a": "hob0r mallow"}]
+
+    def test_all_returned(self):
+        """Tests that all instances are returned, with the mode and compound flag ignored"""
+        data = [{"a": "ab", "b": "x"}, {"a": "bb", "b": "y"}, {"b": "ab"}]
+        filters = [make_filter("replace", "a", "a", "c"), make_filter("match", "b", "x")]
+        expected = [{"a": "cb", "b": "x"}, {"a": "bb", "b": "y"}, {"b": "ab"}]
+        for mode in ["inclusive", "exclusive"]:
+            for compound in [True, False]:
+                assert filter_data(data, filters, mode=mode, compound=compound) == expected
+
+    @pytest.mark.parametrize("copy_mode", COPY_MODES)
+    def test_copy(self, copy_mode):
+        """Tests that only copy="none" modifies the supplied instances"""
+        data = [{"a": {"b": "ab"}, "c": [1]}, {"a": {"b": "xy"}, "c": [2]}]
+        result = filter_data(data, [make_filter("replace", "a.b", "a", "z")], copy=copy_mode)
+        assert result == [{"a": {"b": "zb"}, "c": [1]}, {"a": {"b": "xy"}, "c": [2]}]
+        assert data[0]["a"]["b"] == ("zb" if copy_mode == "none" else "ab")
+        assert (result[0]["c"] is data[0]["c"]) is (copy_mode != "full")
+        assert (result[1] is data[1]) is (copy_mode != "full")
+
+
+class Test_Indexed_Dataset:
+    """ """
+    @pytest.mark.parametrize("mode", ["inclusive", "exclusive"])
+    @pytest.mark.parametrize("compound", [True, False])
+    def test_mutations(self, mode, compound):
+        """Tests that queries agree with filter_data() after inserts, updates and deletes"""
+        rng = random.Random(f"{mode}-{compound}")
+        dataset = IndexedDataset(
+            [random_instance(rng) for _ in range(100)], match_fields=["name", "meta.kind", "meta.level"],
+            in_fields=["name", "tags.[0]"],
+        )
+        ids = list(range(100))
+        for _ in range(30):
+            deleted = rng.choice(ids)
+            ids.remove(deleted)
+            dataset.delete(deleted)
+            dataset.update(rng.choice(ids), random_instance(rng))
+            ids.append(dataset.insert(random_instance(rng)))
+            filters = [random_filter(rng) for _ in range(rng.randint(1, 3))]
+            expected = filter_data(list(dataset), filters, mode=mode, compound=compound)
+            assert dataset.query(filters, mode=mode, compound=compound) == expected, filters
+
+    def test_ids(self):
+        """Tests that ids are kept through updates and not reused after deletes"""
+        dataset = IndexedDataset([{"a": "x"}, {"a": "y"}], match_fields=["a"])
+        dataset.delete(0)
+        assert dataset.insert({"a": "x"}) == 2
+        dataset.update(1, {"a": "x"})
+        assert 0 not in dataset and len(dataset) == 2
+        assert dataset[1] == {"a": "x"}
+        assert dataset.query_ids(compile_filters([make_filter("match", "a", "x")])) == [1, 2]
+        with pytest.raises(KeyError):
+            dataset.update(0, {"a": "x"})
@@ -0,0 +1,150 @@
+import pytest
+
+from nested_dict_access_by_key_list import (FlatView, PathSet, assoc_path, compile_path, get_many, in_nested_path,
+ update_paths)
+
+
+ROOT = {"a": {"b": [{"c": "x"}, "y"], "s": "str"}, "t": ("u", {"v": 1}), "n": None, "z": 0}
+
+MISSES = ["a.b.[2]", "a.b.[1].c", "a.s.c", "a.b.c", "a.x", "n.a", "z.a", "t.[2]", "q", "a.b.[0].c.d"]
+HITS = {"a.b.[0].c": "x", "a.b.[1]": "y", "a.s": "str", "t.[1].v": 1, "n": None, "z": 0, "": ROOT}
+
+
+class Test_Path_Accessor:
+    """ """
+    @pytest.mark.parametrize("path", MISSES)
+    def test_miss(self, path):
+        """Tests that missing keys, indexes past the end and paths through scalars are misses"""
+        accessor = compile_path(path)
+        assert not accessor.contains(ROOT)
+        assert accessor.get_or(ROOT, "default") == "default"
+        with pytest.raises(KeyError):
+            accessor.get(ROOT)
+
+    @pytest.mark.parametrize("path, value", HITS.items())
+    def test_hit(self, path, value):
+        """Tests that present items, including falsy ones, are found"""
+        accessor = compile_path(path)
+        assert accessor.contains(ROOT)
+        assert accessor.get(ROOT) is value
+        assert accessor.get_or(ROOT, "default") is value
+
+    def test_negative_index(self):
+        """Tests that negative indexes count from the end, as for lists"""
+        assert compile_path("a.b.[-1]").get(ROOT) == "y"
+        assert not compile_path("a.b.[-3]").contains(ROOT)
+
+    def test_item_sequence(self):
+        """Tests that item sequences are paths, with ints as list indexes and strings as keys"""
+        assert compile_path(["a", "b", 0, "c"]).get(ROOT) == "x"
+        assert compile_path(("a", "b", 0, "c")) is compile_path(["a", "b", 0, "c"])
+        assert not compile_path(["a", "b", "0"]).contains(ROOT)
+        assert compile_path({"1": "x"}.keys()).items == ("1",)
+
+    def test_in_nested_path(self):
+        """Tests in_nested_path() for a missing key"""
+        assert in_nested_path(ROOT, ["a", "b"])
+        assert not in_nested_path(ROOT, ["a", "x"])
+
+    def test_set(self):
+        """Tests that set() needs the parent of the path"""
+        root = {"a": {"b": [1]}}
+        compile_path("a.b.[0]").set(root, 2)
+        compile_path("a.c").set(root, 3)
+        assert root == {"a": {"b": [2], "c": 3}}
+        with pytest.raises(KeyError):
+            compile_path("a.x.y").set(root, 4)
+        with pytest.raises(IndexError):
+            compile_path("a.b.[1]").set(root, 4)
+        with pytest.raises(ValueError):
+            compile_path("").set(root, 4)
+
+
+class Test_Path_Set:
+    """ """
+    def test_get(self):
+        """Tests that each path gets its item, or its default if it is missing"""
+        paths = list(HITS) + MISSES
+        defaults = {MISSES[0]: "first"}
+        expected = tuple(HITS.values()) + ("first",) + ("default",) * (len(MISSES) - 1)
+        assert PathSet(paths, default="default", defaults=defaults).get(ROOT) == expected
+        assert get_many(ROOT, paths, default="default", defaults=defaults) == expected
+
+    def test_shared_prefix(self):
+        """Tests paths that are prefixes of each other, and a missing prefix of other paths"""
+        paths = ["a", "a.b", "a.b.[0]", "a.b.[0].c", "q", "q.r", "q.r.s", "a.s.c"]
+        assert get_many(ROOT, paths) == (ROOT["a"], ROOT["a"]["b"], {"c": "x"}, "x", None, None, None, None)
+
+    def test_as_dict(self):
+        """Tests results keyed by path as supplied, for strings and item sequences"""
+        paths = PathSet(["a.b.[1]", ("t", 0), "q"], default=0)
+        assert paths.get(ROOT, as_dict=True) == {"a.b.[1]": "y", ("t", 0): "u", "q": 0}
+        assert paths.get_batch([ROOT, {}], as_dict=True)[1] == {"a.b.[1]": 0, ("t", 0): 0, "q": 0}
+
+    def test_single_path(self):
+        """Tests that a single path still gets a tuple"""
+        assert PathSet(["a.s"]).get_batch([ROOT, "str", None, 5]) == [("str",), (None,), (None,), (None,)]
+
+
+class Test_Assoc:
+    """ """
+    def test_assoc_path(self):
+        """Tests that only the containers along the path are copied"""
+        root = {"a": {"b": [1, 2]}, "c": {"d": 1}}
+        new = assoc_path(root, "a.b.[1]", 3)
+        assert new == {"a": {"b": [1, 3]}, "c": {"d": 1}}
+        assert root == {"a": {"b": [1, 2]}, "c": {"d": 1}}
+        assert new["c"] is root["c"] and new["a"] is not root["a"]
+
+    def test_tuple(self):
+        """Tests that tuples on the path are copied as tuples"""
+        assert assoc_path(ROOT, "t.[1].v", 2)["t"] == ("u", {"v": 2})
+        assert ROOT["t"][1] == {"v": 1}
+
+    @pytest.mark.parametrize("path", ["a.x.y", "q.r"])
+    def test_missing_parent(self, path):
+        """Tests that a path whose parent is missing is not created"""
+        with pytest.raises(KeyError):
+            assoc_path(ROOT, path, 1)
+
+    def test_update_paths(self):
+        """Tests that nested updates are set in the new value of their parent path"""
+        root = {"a": {"b": 1}, "c": [0]}
+        new = update_paths(root, {"a": {"x": 1}, "a.y": 2, "c.[0]": 3})
+        assert new == {"a": {"x": 1, "y": 2}, "c": [3]}
+        assert root == {"a": {"b": 1}, "c": [0]}
+
+
+class Test_Flat_View:
+    """ """
+    @pytest.mark.parametrize("path", MISSES)
+    def test_miss(self, path):
+        """Tests that missing paths are misses, as for compiled paths"""
+        view = FlatView(ROOT)
+        assert path not in view
+        assert view.get(path, "default") == "default"
+        with pytest.raises(KeyError):
+            view[path]
+
+    @pytest.mark.parametrize("path, value", HITS.items())
+    def test_hit(self, path, value):
+        """Tests that present items are found by dotted path and by path tuple"""
+        view = FlatView(ROOT)
+        assert view[path] is value
+        assert view.get(compile_path(path).items, "default") is value
+
+    def test_set(self):
+        """Tests that the index follows writes through set()"""
+        root = {"a": {"b": {"c": 1}}, "d": [0]}
+        view = FlatView(root)
+        assert view["a.b.c"] == 1
+        view.set("a.b", [5])
+        assert "a.b.c" not in view and view["a.b.[0]"] == 5
+        assert root["a"]["b"] == [5]
+        view.set("a.e", 2)
+        view.set("d.[0]", {"f": 3})
+        assert view["a.e"] == 2 and view["d.[0].f"] == 3
+        with pytest.raises(KeyError):
+            view.set("a.x.y", 1)
+        with pytest.raises(IndexError):
+            view.set("d.[1]", 1)